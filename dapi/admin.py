@@ -2,6 +2,11 @@ from django.contrib import admin
 from .models import Product, Order, DNAService
 # Register your models here.
 
+
+class DNAServiceAdmin(admin.ModelAdmin):
+    readonly_fields = ['service_description']
+
+
 admin.site.register(Order)
 admin.site.register(Product)
-admin.site.register(DNAService)
+admin.site.register(DNAService, DNAServiceAdmin)
@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-from apscheduler.schedulers.background import BackgroundScheduler
 
 
 class DapiConfig(AppConfig):
@@ -7,11 +6,10 @@ class DapiConfig(AppConfig):
     name = 'dapi'
 
     def ready(self):
-        from .periodic_tasks import check_ready_and_send_email
+        from . import signals
+        from .periodic_tasks import start_scheduler
 
-        sched = BackgroundScheduler()
-        sched.add_job(check_ready_and_send_email, 'interval', seconds=1)
-        sched.start()
+        start_scheduler()
 
 
 
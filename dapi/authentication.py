@@ -0,0 +1,119 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import prefetch_related_objects
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from . import versions, hashing
+
+# bumped for every user when group memberships change without naming the users (a cleared group)
+ALL_USERS = 'users'
+
+
+def user_version(pk):
+    return 'user:%s' % pk
+
+
+def in_group(user, name):
+    # uses the groups prefetched by the authentication when they are there
+    return any(group.name == name for group in user.groups.all())
+
+
+class UserCache:
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, user_id, load):
+        # an entry is used while it is young enough and neither the user nor the memberships changed since,
+        # the versions come from memory for VERSION_CHECK_INTERVAL seconds so a hit makes no queries
+        current = versions.current_versions([user_version(user_id), ALL_USERS],
+                                            getattr(settings, 'VERSION_CHECK_INTERVAL', 1))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == current and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.copy(entry[0])
+            self.misses += 1
+        user = load()
+        with self._lock:
+            self._entries[key] = (user, current, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return copy.copy(user)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UserCache(getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+                               getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+        return _cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # the user of a token, with its groups, is read once per AUTH_USER_CACHE_TTL instead of on every request
+
+    def get_user(self, validated_token):
+        if not getattr(settings, 'AUTH_USER_CACHE_TTL', 60):
+            return self.load_user(validated_token)
+        key = validated_token.get(api_settings.JTI_CLAIM) or str(validated_token)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        return get_user_cache().get(key, user_id, lambda: self.load_user(validated_token))
+
+    def load_user(self, validated_token):
+        user = super().get_user(validated_token)
+        prefetch_related_objects([user], 'groups')
+        return user
+
+
+class PooledModelBackend(ModelBackend):
+    # ModelBackend with the password checked on the hashing pool, used by the token endpoint
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # hash anyway so unknown usernames take as long as wrong passwords
+            hashing.make_password(password)
+            return None
+        if hashing.check_user_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,76 @@
+import threading
+
+from django.conf import settings
+
+from .models import Product
+from . import versions
+
+VERSION = 'product-catalog'
+
+
+class ProductCache:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._products = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        # the shared counter tells whether another process changed the catalog, it is read again
+        # once it is VERSION_CHECK_INTERVAL seconds old
+        version = versions.current_version(VERSION, getattr(settings, 'VERSION_CHECK_INTERVAL', 1))
+        if version != self._version:
+            if self._version is not None:
+                self.invalidations += 1
+            self._products.clear()
+            self._version = version
+        return version
+
+    def get_many(self, pks):
+        pks = set(pks)
+        with self._lock:
+            version = self._check_version()
+            found = {pk: self._products[pk] for pk in pks if pk in self._products}
+            self.hits += len(found)
+        missing = pks - found.keys()
+        if missing:
+            loaded = Product.objects.in_bulk(missing)
+            with self._lock:
+                self.misses += len(missing)
+                # rows read while the catalog changed are returned but not kept
+                if version == self._version:
+                    self._products.update(loaded)
+            found.update(loaded)
+        return found
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    def clear(self):
+        with self._lock:
+            self._products.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._products),
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_product_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProductCache()
+        return _cache
@@ -0,0 +1,133 @@
+import logging
+import queue
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+SENT = 'sent'
+FAILED = 'failed'
+
+_lock = threading.Lock()
+_pool = None
+# open connections waiting for the next batch, a batch takes one and gives it back when it is done
+_connections = queue.LifoQueue()
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=getattr(settings, 'EMAIL_DELIVERY_WORKERS', 4),
+                                       thread_name_prefix='email-delivery')
+        return _pool
+
+
+def is_alive(connection):
+    smtp = getattr(connection, 'connection', None)
+    if smtp is None:
+        # not open yet, or not an SMTP backend
+        return True
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _take_connection():
+    # the server may have dropped a pooled connection while it was idle, that is found out with a NOOP
+    # instead of costing a delivery attempt
+    try:
+        connection = _connections.get_nowait()
+    except queue.Empty:
+        return get_connection(fail_silently=False)
+    if not is_alive(connection):
+        # closed, the backend opens a new connection on the next send
+        _close(connection)
+    return connection
+
+
+def close_connections():
+    while True:
+        try:
+            connection = _connections.get_nowait()
+        except queue.Empty:
+            return
+        _close(connection)
+
+
+def is_permanent(error):
+    # 5xx replies and refused recipients will not get better by trying again
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def send_batch(messages):
+    # returns (status, attempts, error) for every message, in order. every outcome is recorded as it happens,
+    # a message that fails in an unexpected way does not keep the ones before it from being recorded as sent.
+    # a temporary failure is tried once more at once over a fresh connection, later retries are left to the
+    # outbox so a batch never sleeps, and when no connection can be opened the rest of the batch fails at once
+    results = []
+    try:
+        connection = _take_connection()
+    except Exception as error:
+        logger.exception('opening a mail connection failed')
+        return [(FAILED, 1, str(error)[:200])] * len(messages)
+    for message in messages:
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                connection.open()
+            except (smtplib.SMTPException, OSError) as error:
+                logger.warning('opening a mail connection failed: %s', error)
+                _close(connection)
+                results.append((FAILED, attempts, str(error)[:200]))
+                results.extend([(FAILED, 1, str(error)[:200])] * (len(messages) - len(results)))
+                _connections.put(connection)
+                return results
+            try:
+                connection.send_messages([message])
+                results.append((SENT, attempts, ''))
+                break
+            except (smtplib.SMTPException, OSError) as error:
+                permanent = is_permanent(error)
+                if not permanent:
+                    # the connection may be broken, the next attempt starts from a fresh one
+                    _close(connection)
+                if permanent or attempts > 1:
+                    logger.warning('delivering mail to %s failed: %s', ', '.join(message.to), error)
+                    results.append((FAILED, attempts, str(error)[:200]))
+                    break
+            except Exception as error:
+                # not an SMTP problem, trying again would not help
+                logger.exception('delivering mail to %s failed', ', '.join(message.to))
+                _close(connection)
+                results.append((FAILED, attempts, str(error)[:200]))
+                break
+    _connections.put(connection)
+    return results
+
+
+def deliver(messages):
+    # batches go out on a bounded number of threads, each batch over one reused connection
+    batch_size = getattr(settings, 'EMAIL_DELIVERY_BATCH', 50)
+    pool = get_pool()
+    futures = [pool.submit(send_batch, messages[start:start + batch_size])
+               for start in range(0, len(messages), batch_size)]
+    results = []
+    for future in futures:
+        results.extend(future.result())
+    return results
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+
+class OrderEventHub:
+    # one poller per process feeds every open stream, so idle streams cost a queue each and no queries
+
+    def __init__(self):
+        self.subscribers = {}
+        self._task = None
+        self._since = None
+        self._sent = {}
+
+    def subscribe(self, customer_id):
+        queue = asyncio.Queue(maxsize=getattr(settings, 'ORDER_EVENTS_QUEUE_SIZE', 100))
+        self.subscribers.setdefault(customer_id, set()).add(queue)
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            # changes made while nobody was listening are not replayed
+            self._since = timezone.now()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, customer_id, queue):
+        queues = self.subscribers.get(customer_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(customer_id, None)
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                await asyncio.sleep(getattr(settings, 'ORDER_EVENTS_POLL_INTERVAL', 1))
+                try:
+                    changes = await sync_to_async(self.changes)()
+                except Exception:
+                    logger.exception('reading order status changes failed')
+                    # the next poll starts from a new connection
+                    await sync_to_async(connection.close)()
+                    continue
+                self.dispatch(changes)
+        finally:
+            self._task = None
+
+    def changes(self):
+        # changes committed late can carry a slightly older time, the overlap rereads them
+        # and the events already sent are skipped
+        started = timezone.now()
+        cutoff = self._since - timedelta(seconds=getattr(settings, 'ORDER_EVENTS_OVERLAP', 5))
+        rows = Order.objects.filter(status_changed_at__gt=cutoff).order_by('status_changed_at') \
+            .values_list('pk', 'customer_id', 'status', 'status_changed_at')
+        changes = []
+        for pk, customer_id, status, changed_at in rows:
+            if (pk, status, changed_at) not in self._sent:
+                self._sent[(pk, status, changed_at)] = changed_at
+                changes.append((customer_id, {'id': pk, 'status': status, 'changed_at': changed_at.isoformat()}))
+        self._sent = {key: changed_at for key, changed_at in self._sent.items() if changed_at > cutoff}
+        self._since = started
+        return changes
+
+    def dispatch(self, changes):
+        for customer_id, event in changes:
+            for queue in self.subscribers.get(customer_id, ()):
+                if queue.full():
+                    # a client that does not keep up loses its oldest events rather than holding up the others
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = OrderEventHub()
+    return _hub
+
+
+def customer_id(user_id):
+    return User.objects.filter(pk=user_id, is_active=True).values_list('pk', flat=True).first()
+
+
+async def authenticate(scope):
+    # EventSource cannot send headers, so the access token may also come as ?token=
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization' and value.decode().startswith('Bearer '):
+            token = value.decode()[len('Bearer '):]
+    if not token:
+        return None
+    try:
+        user_id = AccessToken(token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    return await sync_to_async(customer_id)(user_id)
+
+
+async def respond(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def order_events(scope, receive, send):
+    # server-sent events with the status changes of the authenticated customer's orders
+    if scope['method'] != 'GET':
+        return await respond(send, 405, {'detail': 'method not allowed'})
+    customer = await authenticate(scope)
+    if customer is None:
+        return await respond(send, 401, {'detail': 'a valid access token is required'})
+
+    hub = get_hub()
+    queue = hub.subscribe(customer)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        heartbeat = getattr(settings, 'ORDER_EVENTS_HEARTBEAT', 15)
+        while not disconnected.done():
+            event = asyncio.ensure_future(queue.get())
+            await asyncio.wait({event, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            if event.done():
+                body = 'event: order\ndata: %s\n\n' % json.dumps(event.result())
+            else:
+                event.cancel()
+                body = ': keep-alive\n\n'
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+    finally:
+        hub.unsubscribe(customer, queue)
+        disconnected.cancel()
@@ -0,0 +1,120 @@
+import mmap
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+
+import numpy as np
+
+from . import scoring, jobs
+
+_NEWLINE = ord('\n')
+_RETURN = ord('\r')
+_HEADER = ord('>')
+# bytes searched for newlines per step of parse, and bases of short lines gathered at once (the gather
+# index takes eight bytes per base)
+_CHUNK = 1 << 18
+_GATHER = 1 << 15
+
+
+@contextmanager
+def mapped(upload):
+    # uploads spooled to a temporary file are mapped from disk, small in-memory ones are read as they are
+    if not hasattr(upload, 'temporary_file_path'):
+        upload.seek(0)
+        yield upload.read()
+        return
+    with open(upload.temporary_file_path(), 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            yield b''
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            yield mapping
+
+
+def parse_upload(upload):
+    # the error is raised again once the mapping is closed, its traceback would keep views of the mapping
+    # alive and closing the mapping would then fail with BufferError
+    error = None
+    with mapped(upload) as data:
+        try:
+            return parse(data)
+        except ValueError as exc:
+            error = str(exc)
+    raise ValueError(error)
+
+
+def _newlines(raw):
+    # searched a chunk at a time so no mask as long as the file is made
+    found = [np.flatnonzero(raw[first:first + _CHUNK] == _NEWLINE) + first for first in range(0, len(raw), _CHUNK)]
+    return np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+
+
+def _copy_lines(raw, starts, ends, out):
+    # lines are gathered a group of about _GATHER bases at a time through an index as long as the group,
+    # a line longer than that is copied on its own
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=offsets[1:])
+    first = 0
+    while first < len(starts):
+        last = max(int(np.searchsorted(offsets, offsets[first] + _GATHER, 'right')) - 1, first + 1)
+        begin, end = offsets[first], offsets[last]
+        if last == first + 1:
+            out[begin:end] = raw[starts[first]:ends[first]]
+        else:
+            shifts = starts[first:last] - (offsets[first:last] - begin)
+            out[begin:end] = raw[np.repeat(shifts, ends[first:last] - starts[first:last]) + np.arange(end - begin)]
+        first = last
+
+
+def parse(data):
+    # returns the sequence lines of every record joined into one uint8 buffer and the record offsets,
+    # the work arrays are per line or per chunk, only the returned buffer is as long as the bases
+    raw = np.frombuffer(data, dtype=np.uint8)
+    newlines = _newlines(raw)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(raw)]))
+    del newlines
+    nonempty = starts < ends
+    starts, ends = starts[nonempty], ends[nonempty]
+    ends = ends - (raw[ends - 1] == _RETURN)
+    headers = raw[starts] == _HEADER
+    if len(headers) and not headers[0]:
+        raise ValueError('FASTA records have to start with a > header line')
+
+    sequence_lines = ~headers
+    records = (np.cumsum(headers) - 1)[sequence_lines]
+    starts, ends = starts[sequence_lines], ends[sequence_lines]
+    counts = np.bincount(records, weights=ends - starts, minlength=int(headers.sum())).astype(np.int64)
+    bounds = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=bounds[1:])
+
+    sequence = np.empty(int(bounds[-1]), dtype=np.uint8)
+    _copy_lines(raw, starts, ends, sequence)
+    del raw
+    return sequence, bounds
+
+
+def fingerprints(sequence, bounds):
+    return [scoring.fingerprint_bytes(sequence[begin:end]) for begin, end in zip(bounds.tolist(), bounds[1:].tolist())]
+
+
+def iter_genes(sequence, bounds):
+    for begin, end in zip(bounds.tolist(), bounds[1:].tolist()):
+        yield sequence[begin:end].tobytes().decode('ascii', errors='replace')
+
+
+def score(sequence, bounds, keys):
+    if jobs.should_run_parallel(len(sequence)):
+        return jobs.parallel_scan(sequence, bounds, keys)
+    chunk_size = getattr(settings, 'DNA_SCORING_CHUNK', 1000)
+    is_valid = True
+    reasons = bytearray()
+    seen = set()
+    for first in range(0, len(keys), chunk_size):
+        last = min(first + chunk_size, len(keys))
+        begin = bounds[first]
+        batch_reasons = scoring.scan_buffer(sequence[begin:bounds[last]], bounds[first:last + 1] - begin)['reason']
+        if not scoring.merge_reasons(reasons, batch_reasons.tobytes(), keys[first:last], seen):
+            is_valid = False
+    return is_valid, reasons, int(bounds[-1])
@@ -0,0 +1,9 @@
+from django_filters import rest_framework as filters
+
+from .models import Order
+
+
+class OrderFilter(filters.FilterSet):
+    class Meta:
+        model = Order
+        fields = ['status', 'customer', 'product']
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+import numpy as np
+
+from .models import DNAService, GeneFingerprint
+from . import scoring
+
+
+class BloomFilter:
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = np.zeros((bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, fingerprints):
+        # double hashing on the two halves of every 64-bit fingerprint
+        values = np.asarray(fingerprints, dtype=np.int64).view(np.uint64)
+        first = values & np.uint64(0xffffffff)
+        second = (values >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(self.bits)
+
+    def add(self, fingerprints):
+        positions = self._positions(fingerprints).ravel()
+        np.bitwise_or.at(self.array, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def might_contain(self, fingerprints):
+        positions = self._positions(fingerprints)
+        bits = (self.array[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+
+class GeneIndex:
+
+    def __init__(self, bits, hashes):
+        self.bloom = BloomFilter(bits, hashes)
+        self.loaded_upto = 0
+        self.synced_at = float('-inf')
+        self.syncs = 0
+        self.lookups = 0
+        self.bloom_rejections = 0
+        # (time, loaded_upto) after every sync, the rows above the oldest one still needed are read again
+        self._marks = deque([(float('-inf'), 0)])
+        self._lock = threading.Lock()
+
+    def sync(self, force=False):
+        # fingerprints stored since the last sync, by this or any other process, at most once per
+        # GENE_INDEX_SYNC_INTERVAL seconds. a transaction can commit a pk below loaded_upto after a sync, so
+        # everything above the highest pk loaded GENE_INDEX_SYNC_OVERLAP seconds before the last sync is read again
+        with self._lock:
+            started = time.monotonic()
+            if not force and started < self.synced_at + getattr(settings, 'GENE_INDEX_SYNC_INTERVAL', 1):
+                return
+            cutoff = self.synced_at - getattr(settings, 'GENE_INDEX_SYNC_OVERLAP', 5)
+            while len(self._marks) > 1 and self._marks[1][0] <= cutoff:
+                self._marks.popleft()
+            rows = GeneFingerprint.objects.filter(pk__gt=self._marks[0][1]).order_by('pk')
+            chunk = []
+            for pk, fingerprint in rows.values_list('pk', 'fingerprint').iterator(chunk_size=10000):
+                chunk.append(fingerprint)
+                self.loaded_upto = max(self.loaded_upto, pk)
+                if len(chunk) == 10000:
+                    self.bloom.add(chunk)
+                    chunk = []
+            if chunk:
+                self.bloom.add(chunk)
+            self._marks.append((time.monotonic(), self.loaded_upto))
+            self.synced_at = started
+            self.syncs += 1
+
+    def known(self, fingerprints):
+        # the filter answers most lookups, only its positives are checked against the table
+        fingerprints = np.asarray(fingerprints, dtype=np.int64)
+        known = np.zeros(len(fingerprints), dtype=bool)
+        if not len(fingerprints):
+            return known
+        self.sync()
+        maybe = self.bloom.might_contain(fingerprints)
+        candidates = fingerprints[maybe]
+        found = []
+        for start in range(0, len(candidates), 500):
+            found.extend(GeneFingerprint.objects.filter(fingerprint__in=candidates[start:start + 500].tolist())
+                         .values_list('fingerprint', flat=True))
+        known[maybe] = np.isin(candidates, np.array(found, dtype=np.int64))
+        with self._lock:
+            self.lookups += len(fingerprints)
+            self.bloom_rejections += len(fingerprints) - len(candidates)
+        return known
+
+    def record(self, service):
+        # stores the genes of a saved service and returns how many of them were submitted before
+        return self.record_fingerprints(service, (scoring.fingerprint(gene) for gene in service.genes()))
+
+    def record_fingerprints(self, service, fingerprints):
+        fingerprints = np.unique(np.fromiter(fingerprints, dtype=np.int64))
+        known = self.known(fingerprints)
+        if service.job_attempt and known.any():
+            # a job submitted again finds the genes an earlier attempt stored before it was lost
+            own = GeneFingerprint.objects.filter(service=service).values_list('fingerprint', flat=True)
+            known &= ~np.isin(fingerprints, np.fromiter(own, dtype=np.int64))
+        new = fingerprints[~known]
+        GeneFingerprint.objects.bulk_create([GeneFingerprint(fingerprint=fingerprint, service=service)
+                                             for fingerprint in new.tolist()], batch_size=1000, ignore_conflicts=True)
+        with self._lock:
+            self.bloom.add(new)
+        repeated_genes = int(known.sum())
+        if repeated_genes != service.repeated_genes:
+            service.repeated_genes = repeated_genes
+            DNAService.objects.filter(pk=service.pk).update(repeated_genes=repeated_genes)
+        return repeated_genes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded_upto': self.loaded_upto,
+                'syncs': self.syncs,
+                'lookups': self.lookups,
+                'bloom_rejections': self.bloom_rejections,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_gene_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = GeneIndex(getattr(settings, 'GENE_INDEX_BLOOM_BITS', 1 << 24),
+                               getattr(settings, 'GENE_INDEX_BLOOM_HASHES', 4))
+        return _index
@@ -0,0 +1,152 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = 503
+    default_detail = 'too many password operations in progress, try again later'
+    default_code = 'hashing_busy'
+
+
+def setup_worker():
+    # spawned workers start without the apps, forked ones already have them and return at once
+    django.setup()
+
+
+class HashingService:
+    # password hashing runs in worker processes so it does not hold the GIL of the serving process,
+    # at most workers + queue_size operations are admitted and the rest wait up to timeout seconds
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_time = 0.0
+        self._slots = threading.BoundedSemaphore(self.capacity) if workers else None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(),
+                                                 initializer=setup_worker)
+            return self._pool
+
+    def submit(self, function, *args):
+        # returns a future, the slot it takes is given back when it is done
+        if not self.workers:
+            future = Future()
+            future.set_result(function(*args))
+            return future
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        admitted = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self.waiting -= 1
+            if admitted:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+        if not admitted:
+            raise HashingBusy()
+        started = time.monotonic()
+
+        def done(future):
+            self._slots.release()
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.busy_time += time.monotonic() - started
+
+        try:
+            future = self.get_pool().submit(function, *args)
+        except BaseException:
+            done(None)
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    def map(self, function, values):
+        # every value is admitted on its own, a large batch waits for room instead of filling the queue
+        futures = [self.submit(function, value) for value in values]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'busy_time': self.busy_time,
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_hashing_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = HashingService(getattr(settings, 'PASSWORD_HASHING_WORKERS', 0),
+                                      getattr(settings, 'PASSWORD_HASHING_QUEUE', 0),
+                                      getattr(settings, 'PASSWORD_HASHING_TIMEOUT', None))
+        return _service
+
+
+def make_password(password):
+    return get_hashing_service().run(hashers.make_password, password)
+
+
+def make_passwords(passwords):
+    return get_hashing_service().map(hashers.make_password, passwords)
+
+
+def must_update(encoded):
+    preferred = hashers.get_hasher('default')
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def check_password(password, encoded, setter=None):
+    # same answers as django.contrib.auth.hashers.check_password, hashes made with old settings are
+    # upgraded through setter
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+    valid = get_hashing_service().run(hashers.check_password, password, encoded)
+    if valid and setter is not None and must_update(encoded):
+        setter(password)
+    return valid
+
+
+def check_user_password(user, password):
+    def setter(raw_password):
+        user.password = make_password(raw_password)
+        user.save(update_fields=['password'])
+
+    return check_password(password, user.password, setter)
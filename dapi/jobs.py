@@ -0,0 +1,217 @@
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+import numpy as np
+
+from .models import DNAService, OrderStatus
+from .gene_index import get_gene_index
+from . import scoring, verdict_cache
+
+logger = logging.getLogger(__name__)
+
+_context = multiprocessing.get_context()
+_lock = threading.Lock()
+_pool = None
+_dispatcher = None
+
+# statuses of services whose job has not finished
+PENDING = [OrderStatus.WAITING, OrderStatus.IN_PRODUCTION]
+
+
+def get_workers():
+    return getattr(settings, 'DNA_SCORING_WORKERS', 0)
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=get_workers(), mp_context=_context)
+        return _pool
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dna-scoring')
+        return _dispatcher
+
+
+def pool_score_batches(batches, engine):
+    # keeps a bounded number of batches in flight so the submission is never fully in memory,
+    # cached verdicts are resolved here and only the misses travel to the pool
+    pool = get_pool()
+    cache = verdict_cache.get_verdict_cache()
+    window = deque()
+
+    def finish(batch, cached, future):
+        if cached is None:
+            return batch, future.result()
+        verdicts, keys = cached
+        return batch, cache.fill(verdicts, keys, future.result() if future else [])
+
+    for batch in batches:
+        if cache is None:
+            window.append((batch, None, pool.submit(engine, batch)))
+        else:
+            verdicts, keys = cache.lookup(batch)
+            missing = [gene for gene, verdict in zip(batch, verdicts) if verdict is None]
+            window.append((batch, (verdicts, keys), pool.submit(engine, missing) if missing else None))
+        if len(window) > 2 * get_workers():
+            yield finish(*window.popleft())
+    while window:
+        yield finish(*window.popleft())
+
+
+def should_run_parallel(size):
+    threshold = getattr(settings, 'DNA_SCORING_PARALLEL_THRESHOLD', 0)
+    return get_workers() > 1 and bool(threshold) and size >= threshold
+
+
+def split_genes(bounds, chunks):
+    # gene index cuts giving every chunk about the same number of bases
+    targets = np.linspace(0, bounds[-1], chunks + 1)[1:-1]
+    return np.unique(np.concatenate(([0], np.searchsorted(bounds, targets), [len(bounds) - 1]))).tolist()
+
+
+def parallel_reasons(genes, progress=None):
+    # the genes are encoded once and scanned in parallel, only the fingerprints stay per gene
+    buffer = bytearray()
+    bounds = [np.zeros(1, dtype=np.int64)]
+    keys = []
+    for batch in scoring.batched(genes):
+        encoded, lengths, batch_bounds = scoring.encode(batch)
+        bounds.append(batch_bounds[1:] + len(buffer))
+        buffer += encoded.data
+        keys.extend(map(scoring.fingerprint, batch))
+    return parallel_scan(buffer, np.concatenate(bounds), keys, progress)
+
+
+def parallel_scan(buffer, bounds, keys, progress=None):
+    # the buffer goes to shared memory, workers scan slices of it and send back reason bytes
+    size = len(buffer)
+    buffer_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    bounds_memory = shared_memory.SharedMemory(create=True, size=bounds.nbytes)
+    try:
+        buffer_memory.buf[:size] = buffer
+        bounds_memory.buf[:bounds.nbytes] = bounds.tobytes()
+        del buffer
+        pool = get_pool()
+        cuts = split_genes(bounds, 4 * get_workers())
+        # forked workers share the parent's resource tracker, others have to stay out of it
+        own_tracker = _context.get_start_method() != 'fork'
+        futures = [pool.submit(scoring.scan_shared, buffer_memory.name, bounds_memory.name, size, len(keys),
+                               first, last, own_tracker) for first, last in zip(cuts, cuts[1:])]
+        is_valid = True
+        reasons = bytearray()
+        seen = set()
+        for first, last, future in zip(cuts, cuts[1:], futures):
+            if not scoring.merge_reasons(reasons, future.result(), keys[first:last], seen):
+                is_valid = False
+            if progress is not None:
+                progress(len(reasons))
+    finally:
+        for memory in (buffer_memory, bounds_memory):
+            memory.close()
+            memory.unlink()
+    return is_valid, reasons, int(bounds[-1])
+
+
+def run_scoring_job(pk, scorer=scoring.score_batches, attempt=0):
+    # the job only runs while its attempt owns the service, an attempt that was taken over stops here
+    claimed = DNAService.objects.filter(pk=pk, job_attempt=attempt, status__in=PENDING).update(
+        status=OrderStatus.IN_PRODUCTION, scored_genes=0, job_updated_at=timezone.now())
+    if not claimed:
+        return
+    service = DNAService.objects.get(pk=pk)
+
+    def progress(scored_genes):
+        DNAService.objects.filter(pk=pk).update(scored_genes=scored_genes, job_updated_at=timezone.now())
+
+    def with_progress(scored):
+        scored_genes = 0
+        for batch, verdicts in scored:
+            scored_genes += len(batch)
+            progress(scored_genes)
+            yield batch, verdicts
+
+    if should_run_parallel(service.number):
+        is_valid, reasons, number_of_proteins = parallel_reasons(service.genes(), progress)
+    else:
+        batches = scoring.batched(service.genes())
+        is_valid, reasons, number_of_proteins = scoring.tally(with_progress(scorer(batches, scoring.get_engine())))
+    service.scored_genes = len(reasons)
+    service.number = number_of_proteins
+    service.is_valid = is_valid
+    # a valid submission has only valid genes, so reasons are only kept for invalid ones
+    service.reasons = b'' if is_valid else bytes(reasons)
+    service.status = OrderStatus.READY
+    service.job_updated_at = timezone.now()
+    if is_valid:
+        service.analyse()
+    # a slow attempt that was taken over meanwhile leaves the results to the attempt that took it over
+    if not DNAService.objects.filter(pk=pk, job_attempt=attempt).exists():
+        return
+    service.repeated_genes = get_gene_index().record(service)
+    service.save(update_fields=['scored_genes', 'number', 'is_valid', 'reasons', 'repeated_genes', 'gc_profile',
+                                'kmer_counts', 'status', 'job_updated_at'])
+
+
+def run_attempt(pk, attempt, scorer=scoring.score_batches):
+    try:
+        run_scoring_job(pk, scorer, attempt)
+    except Exception as exc:
+        logger.exception('DNA scoring job %s failed', pk)
+        # the job failed, not the DNA, so is_valid stays unknown
+        DNAService.objects.filter(pk=pk, job_attempt=attempt).update(
+            status=OrderStatus.READY, job_error=f'scoring job failed: {exc!r}'[:1000], job_updated_at=timezone.now())
+
+
+def _dispatch(pk, attempt):
+    try:
+        run_attempt(pk, attempt, pool_score_batches)
+    finally:
+        connections.close_all()
+
+
+def submit(service, attempt=0):
+    # without workers the job runs inline, which is what the test suite relies on
+    if not get_workers():
+        run_scoring_job(service.pk, attempt=attempt)
+        return
+    transaction.on_commit(lambda: get_dispatcher().submit(_dispatch, service.pk, attempt))
+
+
+def recover_stale_jobs():
+    # jobs queued or running in a process that stopped leave their services waiting or in production for good,
+    # the ones without progress for DNA_JOB_TIMEOUT seconds get a new attempt, a service lost
+    # DNA_JOB_MAX_ATTEMPTS times is reported as failed
+    max_attempts = getattr(settings, 'DNA_JOB_MAX_ATTEMPTS', 3)
+    updated_before = timezone.now() - timedelta(seconds=getattr(settings, 'DNA_JOB_TIMEOUT', 600))
+    stale = DNAService.objects.filter(status__in=PENDING, job_updated_at__lt=updated_before)
+    resubmitted = []
+    for pk, attempt in stale.values_list('pk', 'job_attempt'):
+        # the update is the claim, so one process takes over an attempt
+        service = stale.filter(pk=pk, job_attempt=attempt)
+        if attempt + 1 >= max_attempts:
+            service.update(status=OrderStatus.READY, job_error=f'scoring job was lost {attempt + 1} times',
+                           job_updated_at=timezone.now())
+        elif service.update(job_attempt=attempt + 1, status=OrderStatus.WAITING, job_updated_at=timezone.now()):
+            logger.warning('DNA scoring job %s was lost, submitting it again', pk)
+            resubmitted.append((pk, attempt + 1))
+    for pk, attempt in resubmitted:
+        if get_workers():
+            get_dispatcher().submit(_dispatch, pk, attempt)
+        else:
+            run_attempt(pk, attempt)
+    return len(resubmitted)
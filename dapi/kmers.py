@@ -0,0 +1,96 @@
+import struct
+
+from django.conf import settings
+
+import numpy as np
+
+from . import scoring
+
+# layout: magic, version, k, number of distinct k-mers, then their codes and counts (uint32 each) in code order
+# a k-mer code holds 2 bits per base, A=0 C=1 G=2 T=3, first base in the high bits
+MAGIC = b'KM'
+VERSION = 1
+MAX_K = 12
+# up to this k every possible k-mer gets a counter (4 ** 10 counters), above it only the ones that occur
+DENSE_K = 10
+
+_HEADER = struct.Struct('<2sBBI')
+_CODES = np.zeros(256, dtype=np.uint32)
+_CODES[list(b'ACGT')] = np.arange(4, dtype=np.uint32)
+_LETTERS = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def get_k(k=None):
+    return k or getattr(settings, 'DNA_KMER_SIZE', 6)
+
+
+def kmer_codes(buffer, bounds, k):
+    # code of every k-mer that fits in a gene, built with one shifted pass per base of the k-mer
+    codes = _CODES[buffer]
+    windows = np.maximum(np.diff(bounds) - k + 1, 0)
+    offsets = np.zeros(len(windows) + 1, dtype=np.int64)
+    np.cumsum(windows, out=offsets[1:])
+    starts = np.repeat(bounds[:-1] - offsets[:-1], windows) + np.arange(offsets[-1])
+    kmers = np.zeros(len(starts), dtype=np.uint32)
+    for shift in range(k):
+        kmers <<= np.uint32(2)
+        kmers |= codes[starts + shift]
+    return kmers
+
+
+def merge_counts(codes, counts, batch_codes, batch_counts):
+    # both sides are sorted by code and hold every code once, codes already counted are added to in place
+    # and the new ones inserted where they belong, so a batch costs one pass over the totals and no sort
+    positions = np.searchsorted(codes, batch_codes)
+    found = positions < len(codes)
+    found[found] = codes[positions[found]] == batch_codes[found]
+    counts[positions[found]] += batch_counts[found]
+    new = ~found
+    return np.insert(codes, positions[new], batch_codes[new]), np.insert(counts, positions[new], batch_counts[new])
+
+
+def count_kmers(genes, k=None):
+    k = get_k(k)
+    if not 1 <= k <= MAX_K:
+        raise ValueError('k has to be between 1 and %d' % MAX_K)
+    dense = k <= DENSE_K
+    if dense:
+        totals = np.zeros(4 ** k, dtype=np.int64)
+    else:
+        codes = np.zeros(0, dtype=np.uint32)
+        totals = np.zeros(0, dtype=np.int64)
+    for batch in scoring.batched(genes):
+        buffer, lengths, bounds = scoring.encode(batch)
+        kmers = kmer_codes(buffer, bounds, k)
+        if dense:
+            totals += np.bincount(kmers, minlength=len(totals))
+        else:
+            batch_codes, batch_counts = np.unique(kmers, return_counts=True)
+            codes, totals = merge_counts(codes, totals, batch_codes, batch_counts)
+    if dense:
+        codes = np.flatnonzero(totals).astype(np.uint32)
+        totals = totals[codes]
+    return _HEADER.pack(MAGIC, VERSION, k, len(codes)) + codes.astype('<u4').tobytes() + \
+        totals.astype('<u4').tobytes()
+
+
+def read_counts(data):
+    # returns k, the k-mer codes and their counts
+    data = bytes(data)
+    magic, version, k, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not k-mer counts')
+    codes = np.frombuffer(data, dtype='<u4', count=count, offset=_HEADER.size)
+    counts = np.frombuffer(data, dtype='<u4', count=count, offset=_HEADER.size + codes.nbytes)
+    return k, codes, counts
+
+
+def kmer_strings(codes, k):
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint32)
+    letters = _LETTERS[(codes[:, None] >> shifts[None, :]) & np.uint32(3)]
+    return [kmer.decode('ascii') for kmer in letters.reshape(-1).view('S%d' % k).tolist()]
+
+
+def counts_dict(data):
+    k, codes, counts = read_counts(data)
+    return dict(zip(kmer_strings(codes, k), counts.tolist()))
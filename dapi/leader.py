@@ -0,0 +1,42 @@
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # without flock (windows) every process takes the lead, fine for a single development server
+    fcntl = None
+
+
+class LeaderLock:
+    # an exclusive flock on a file, the kernel drops it when the holding process dies
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        if self._file is not None:
+            return True
+        file = open(self.path, 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                return False
+        # the pid is only there for whoever looks at the file
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0006_dnaservice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='gene_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='is_valid',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='results',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='scored_genes',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,116 @@
+import json
+import re
+import struct
+import zlib
+from json.decoder import scanstring
+
+from django.db import migrations, models
+
+# a frozen copy of the version 1 layout of dapi.packing, later changes to the module must not change this migration
+MAGIC = b'DN'
+VERSION = 1
+COMPRESSED = 0x01
+RAW = 0x02
+HEADER = struct.Struct('<2sBB')
+COUNT = struct.Struct('<I')
+CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_genes(text):
+    pos = WHITESPACE.match(text, 0).end()
+    if text[pos:pos + 1] != '[':
+        raise ValueError('DNA must be a list of genes')
+    pos = WHITESPACE.match(text, pos + 1).end()
+    if text[pos:pos + 1] != ']':
+        while True:
+            if text[pos:pos + 1] != '"':
+                raise ValueError('genes must be strings')
+            gene, pos = scanstring(text, pos + 1)
+            yield gene
+            pos = WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] == ']':
+                break
+            if text[pos:pos + 1] != ',':
+                raise ValueError('expected , or ] at %d' % pos)
+            pos = WHITESPACE.match(text, pos + 1).end()
+    if WHITESPACE.match(text, pos + 1).end() != len(text):
+        raise ValueError('extra data after the list of genes')
+
+
+def frame(flags, payload):
+    compressed = zlib.compress(payload)
+    if len(compressed) < len(payload):
+        flags |= COMPRESSED
+        payload = compressed
+    return HEADER.pack(MAGIC, VERSION, flags) + payload
+
+
+def pack_text(text):
+    try:
+        genes = list(iter_genes(text))
+    except ValueError:
+        genes = None
+    if genes is None or any(base not in CODES for gene in genes for base in gene):
+        return frame(RAW, text.encode('utf-8', 'surrogatepass'))
+    offsets = [0]
+    for gene in genes:
+        offsets.append(offsets[-1] + len(gene))
+    codes = [CODES[base] for gene in genes for base in gene]
+    codes += [0] * (-len(codes) % 4)
+    packed = bytes((codes[i] << 6) | (codes[i + 1] << 4) | (codes[i + 2] << 2) | codes[i + 3]
+                   for i in range(0, len(codes), 4))
+    return frame(0, COUNT.pack(len(genes)) + struct.pack('<%dI' % len(offsets), *offsets) + packed)
+
+
+def unpack_text(data):
+    if not data:
+        return ''
+    data = bytes(data)
+    magic, version, flags = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a packed DNA description')
+    payload = data[HEADER.size:]
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+    if flags & RAW:
+        return payload.decode('utf-8', 'surrogatepass')
+    count, = COUNT.unpack_from(payload)
+    offsets = struct.unpack_from('<%dI' % (count + 1), payload, COUNT.size)
+    bases = ''.join('ACGT'[byte >> shift & 3] for byte in payload[COUNT.size + 4 * (count + 1):]
+                    for shift in (6, 4, 2, 0))
+    return json.dumps([bases[begin:end] for begin, end in zip(offsets, offsets[1:])])
+
+
+def pack_descriptions(apps, schema_editor):
+    DNAService = apps.get_model('dapi', 'DNAService')
+    for service in DNAService.objects.only('id', 'service_description').iterator():
+        service.packed_description = pack_text(service.service_description)
+        service.save(update_fields=['packed_description'])
+
+
+def unpack_descriptions(apps, schema_editor):
+    DNAService = apps.get_model('dapi', 'DNAService')
+    for service in DNAService.objects.only('id', 'packed_description').iterator():
+        service.service_description = unpack_text(service.packed_description)
+        service.save(update_fields=['service_description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0007_dnaservice_scoring_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='packed_description',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(pack_descriptions, unpack_descriptions),
+        migrations.RemoveField(
+            model_name='dnaservice',
+            name='service_description',
+        ),
+    ]
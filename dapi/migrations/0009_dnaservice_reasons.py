@@ -0,0 +1,106 @@
+import json
+import struct
+import zlib
+
+from django.db import migrations, models
+
+# frozen copies of the version 1 layout of dapi.packing and of the scoring rules this migration was written for,
+# later changes to those modules must not change it
+HEADER = struct.Struct('<2sBB')
+COUNT = struct.Struct('<I')
+COMPRESSED = 0x01
+RAW = 0x02
+MIN_GENE_LENGTH = 10
+MAX_GENE_LENGTH = 5000
+GC_LOW = 0.25
+GC_HIGH = 0.65
+VALID = 0
+BAD_LENGTH = 1
+BAD_ALPHABET = 2
+LOW_GC = 3
+HIGH_GC = 4
+DUPLICATE = 5
+
+
+def unpack_genes(data):
+    if not data:
+        return []
+    data = bytes(data)
+    magic, version, flags = HEADER.unpack_from(data)
+    if magic != b'DN' or version != 1:
+        raise ValueError('not a packed DNA description')
+    payload = data[HEADER.size:]
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+    if flags & RAW:
+        genes = json.loads(payload.decode('utf-8', 'surrogatepass'))
+        if not isinstance(genes, list) or not all(isinstance(gene, str) for gene in genes):
+            raise ValueError('DNA must be a list of genes')
+        return genes
+    count, = COUNT.unpack_from(payload)
+    offsets = struct.unpack_from('<%dI' % (count + 1), payload, COUNT.size)
+    bases = ''.join('ACGT'[byte >> shift & 3] for byte in payload[COUNT.size + 4 * (count + 1):]
+                    for shift in (6, 4, 2, 0))
+    return [bases[begin:end] for begin, end in zip(offsets, offsets[1:])]
+
+
+def gene_reason(gene):
+    if len(gene) < MIN_GENE_LENGTH or len(gene) > MAX_GENE_LENGTH:
+        return BAD_LENGTH
+    if not all(ch in 'ATGC' for ch in gene):
+        return BAD_ALPHABET
+    ratio = (gene.count('G') + gene.count('C')) * 1.0 / len(gene)
+    if ratio <= GC_LOW:
+        return LOW_GC
+    if ratio >= GC_HIGH:
+        return HIGH_GC
+    return VALID
+
+
+def dna_reasons(genes):
+    seen = set()
+    reasons = bytearray()
+    for gene in genes:
+        reason = gene_reason(gene)
+        reasons.append(DUPLICATE if reason == VALID and gene in seen else reason)
+        seen.add(gene)
+    return reasons
+
+
+def verdict_strings(reasons):
+    return ["valid" if reason in (VALID, DUPLICATE) else "invalid" for reason in reasons]
+
+
+def score_reasons(apps, schema_editor):
+    DNAService = apps.get_model('dapi', 'DNAService')
+    for service in DNAService.objects.filter(is_valid=False).exclude(results='').iterator():
+        reasons = dna_reasons(unpack_genes(service.packed_description))
+        service.reasons = bytes(reasons)
+        service.save(update_fields=['reasons'])
+
+
+def reasons_to_results(apps, schema_editor):
+    DNAService = apps.get_model('dapi', 'DNAService')
+    for service in DNAService.objects.filter(is_valid=False).exclude(reasons=b'').iterator():
+        service.results = json.dumps(verdict_strings(bytes(service.reasons)))
+        service.save(update_fields=['results'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0008_dnaservice_packed_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='reasons',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(score_reasons, reasons_to_results),
+        migrations.RemoveField(
+            model_name='dnaservice',
+            name='results',
+        ),
+    ]
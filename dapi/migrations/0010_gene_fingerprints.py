@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0009_dnaservice_reasons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='repeated_genes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='GeneFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.BigIntegerField(unique=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dapi.dnaservice')),
+            ],
+        ),
+    ]
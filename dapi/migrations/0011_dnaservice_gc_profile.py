@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0010_gene_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='gc_profile',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='gc_window',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='dnaservice',
+            name='type',
+            field=models.CharField(choices=[('dna_scoring', 'dna_scoring'), ('gc_profile', 'gc_profile')], default='dna_scoring', max_length=15),
+        ),
+    ]
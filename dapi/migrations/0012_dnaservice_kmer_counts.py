@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0011_dnaservice_gc_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='kmer_counts',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='kmer_size',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='dnaservice',
+            name='type',
+            field=models.CharField(choices=[('dna_scoring', 'dna_scoring'), ('gc_profile', 'gc_profile'), ('kmer_count', 'kmer_count')], default='dna_scoring', max_length=15),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def queue_ready_orders(apps, schema_editor):
+    # the old poller picked up every ready order, they are handed to the outbox instead
+    Order = apps.get_model('dapi', 'Order')
+    OrderNotification = apps.get_model('dapi', 'OrderNotification')
+    ready = Order.objects.filter(status='ready').values_list('pk', flat=True)
+    OrderNotification.objects.bulk_create([OrderNotification(order_id=pk) for pk in ready.iterator()],
+                                          batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0013_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dapi.order')),
+            ],
+        ),
+        migrations.RunPython(queue_ready_orders, migrations.RunPython.noop),
+    ]
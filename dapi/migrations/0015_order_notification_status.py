@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0014_order_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='notification_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='notification_status',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
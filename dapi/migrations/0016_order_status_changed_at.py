@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0015_order_notification_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status_changed_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dapi', '0018_order_notification_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dnaservice',
+            name='job_attempt',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='job_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='dnaservice',
+            name='job_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
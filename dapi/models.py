@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import packing, profiles, kmers
+
 # Create your models here.
 
 
@@ -26,6 +29,14 @@ class OrderStatus(models.TextChoices):
     DONE = 'done', _('done')
 
 
+# statuses an order may be moved to and the statuses it can come from
+ORDER_TRANSITIONS = {
+    OrderStatus.IN_PRODUCTION: [OrderStatus.WAITING],
+    OrderStatus.READY: [OrderStatus.IN_PRODUCTION],
+    OrderStatus.DONE: [OrderStatus.READY],
+}
+
+
 class Order(models.Model):
 
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -36,15 +47,68 @@ class Order(models.Model):
                               choices=OrderStatus.choices,
                               default=OrderStatus.WAITING)
     order_description = models.CharField(max_length=20000, blank=True)
+    # set on every status change, the order events stream follows it
+    status_changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # outcome of the order-ready email
+    notification_status = models.CharField(max_length=10, blank=True, default='')
+    notification_attempts = models.IntegerField(default=0)
+    notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # the order list pages through id, filtered by status or customer and status
+        indexes = [
+            models.Index(fields=['status', 'id'], name='order_status_id_idx'),
+            models.Index(fields=['customer', 'status', 'id'], name='order_customer_status_id_idx'),
+        ]
+
+    _loaded_status = None
+    # read by the post_save handler that queues the order-ready email
+    _became_ready = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self._became_ready = self.status == OrderStatus.READY and self.status != self._loaded_status
+        if self._loaded_status is not None and self.status != self._loaded_status:
+            self.status_changed_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + ['status_changed_at']
+        # the order and the outbox row queued by post_save are written together
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
     def __str__(self):
         return str(self.product) + ' ' + str(self.customer)
 
 
+class OrderNotification(models.Model):
+    # outbox of orders that became ready, rows are deleted once the customer has been told
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # a failed delivery is tried again from this time on
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
 class DNAService(models.Model):
 
     class ServiceType(models.TextChoices):
         DNA_SCORING = 'dna_scoring', _('dna_scoring')
+        GC_PROFILE = 'gc_profile', _('gc_profile')
+        KMER_COUNT = 'kmer_count', _('kmer_count')
+
+    # price per base of every service type
+    PRICES = {
+        ServiceType.DNA_SCORING: 0.09,
+        ServiceType.GC_PROFILE: 0.12,
+        ServiceType.KMER_COUNT: 0.15,
+    }
 
     customer = models.ForeignKey(User, on_delete=models.CASCADE)
     number = models.IntegerField()
@@ -54,8 +118,59 @@ class DNAService(models.Model):
     status = models.CharField(max_length=15,
                               choices=OrderStatus.choices,
                               default=OrderStatus.WAITING)
-    service_description = models.CharField(max_length=200000, blank=True)
+    packed_description = models.BinaryField(blank=True, default=b'')
+    gene_count = models.IntegerField(default=0)
+    scored_genes = models.IntegerField(default=0)
+    is_valid = models.BooleanField(null=True)
+    reasons = models.BinaryField(blank=True, default=b'')
+    repeated_genes = models.IntegerField(default=0)
+    gc_window = models.IntegerField(null=True, blank=True)
+    gc_profile = models.BinaryField(blank=True, default=b'')
+    kmer_size = models.IntegerField(null=True, blank=True)
+    kmer_counts = models.BinaryField(blank=True, default=b'')
+    # asynchronous jobs: the attempt that owns the service, when that attempt last showed progress and why
+    # the job could not score the description (the description itself is not at fault then)
+    job_attempt = models.IntegerField(default=0)
+    job_updated_at = models.DateTimeField(default=timezone.now)
+    job_error = models.TextField(blank=True, default='')
+
+    _unpacked = (None, None)
+
+    @property
+    def service_description(self):
+        # the packed genes are only expanded back to text when someone reads them,
+        # the text is kept for as long as the packed value it came from is current
+        packed, text = self._unpacked
+        if packed is not self.packed_description:
+            text = packing.unpack_text(self.packed_description)
+            self._unpacked = (self.packed_description, text)
+        return text
+
+    @service_description.setter
+    def service_description(self, value):
+        self.packed_description = packing.pack_text(value)
+        self._unpacked = (self.packed_description, value)
+
+    def genes(self):
+        return packing.iter_genes(self.packed_description)
+
+    def analyse(self):
+        # fills in the results of the analysis types, they run once the genes are known to be valid
+        if self.type == self.ServiceType.GC_PROFILE:
+            self.gc_profile = profiles.gc_profile(self.genes(), self.gc_window)
+        elif self.type == self.ServiceType.KMER_COUNT:
+            self.kmer_counts = kmers.count_kmers(self.genes(), self.kmer_size)
 
     def total_price(self):
-        return self.number*0.09
+        return self.number*self.PRICES[self.type]
+
+
+class GeneFingerprint(models.Model):
+    fingerprint = models.BigIntegerField(unique=True)
+    service = models.ForeignKey(DNAService, on_delete=models.CASCADE)
+
 
+class VersionCounter(models.Model):
+    # bumped when shared data changes, every process compares it with the version its in-process cache was filled at
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
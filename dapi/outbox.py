@@ -0,0 +1,131 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OrderNotification, OrderStatus
+from . import delivery
+
+logger = logging.getLogger(__name__)
+
+_waker = None
+
+
+def set_waker(waker):
+    # the scheduler of this process, if it runs one, resumes the processor through it
+    global _waker
+    _waker = waker
+
+
+def wake():
+    if _waker is not None:
+        _waker()
+
+
+def enqueue(orders):
+    notifications = [OrderNotification(order=order) for order in orders if order.status == OrderStatus.READY]
+    if notifications:
+        OrderNotification.objects.bulk_create(notifications)
+        transaction.on_commit(wake)
+
+
+def enqueue_queryset(queryset):
+    # INSERT ... SELECT, the orders themselves are never loaded
+    connection = connections[queryset.db]
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        cursor.execute('INSERT INTO %s (order_id, created_at, claimed_by, available_at) '
+                       'SELECT id, %%s, %%s, %%s FROM (%s) ready' % (OrderNotification._meta.db_table, sql),
+                       [now, '', now] + list(params))
+        queued = cursor.rowcount
+    if queued:
+        transaction.on_commit(wake)
+    return queued
+
+
+def pending():
+    timeout = getattr(settings, 'ORDER_NOTIFICATION_CLAIM_TIMEOUT', 300)
+    now = timezone.now()
+    # claims of a processor that died are taken over once they are old enough
+    return OrderNotification.objects.filter(Q(claimed_at__isnull=True, available_at__lte=now) |
+                                            Q(claimed_at__lt=now - timedelta(seconds=timeout)))
+
+
+def claim(batch_size):
+    token = uuid.uuid4().hex
+    batch = pending().order_by('pk').values('pk')[:batch_size]
+    claimed = OrderNotification.objects.filter(pk__in=batch).update(claimed_by=token, claimed_at=timezone.now())
+    return token, claimed
+
+
+def ready_message(order):
+    return EmailMessage(
+        subject='Your order is ready',
+        body='Your order of %d x %s is ready.' % (order.number, order.product.product_name),
+        to=[order.customer.email],
+    )
+
+
+def notify(notifications):
+    # emails the customers and records the outcome on every order, returns the orders that were told
+    orders = [notification.order for notification in notifications]
+    addressed = [order for order in orders if order.customer.email]
+    results = dict(zip((order.pk for order in addressed), delivery.deliver([ready_message(order)
+                                                                             for order in addressed])))
+    now = timezone.now()
+    for order in orders:
+        # a customer without an address counts as a failed attempt, so the retries of the order run out
+        order.notification_status, attempts, error = results.get(order.pk, (delivery.FAILED, 1, ''))
+        order.notification_attempts += attempts
+        if order.notification_status == delivery.SENT:
+            order.notified_at = now
+    Order.objects.bulk_update(orders, ['notification_status', 'notification_attempts', 'notified_at'])
+    return [order for order in orders if order.notification_status == delivery.SENT]
+
+
+def retry_delay(order):
+    # doubles with every failed attempt, up to ORDER_NOTIFICATION_RETRY_MAX_DELAY
+    backoff = getattr(settings, 'ORDER_NOTIFICATION_RETRY_BACKOFF', 60)
+    return min(backoff * 2 ** min(order.notification_attempts - 1, 20),
+               getattr(settings, 'ORDER_NOTIFICATION_RETRY_MAX_DELAY', 3600))
+
+
+def process(batch_size=None):
+    # returns how many notifications were handled, 0 when the outbox is empty
+    token, claimed = claim(batch_size or getattr(settings, 'ORDER_NOTIFICATION_BATCH', 100))
+    if not claimed:
+        return 0
+    claimed = list(OrderNotification.objects.filter(claimed_by=token)
+                   .select_related('order__customer', 'order__product'))
+    # orders that moved on since they were queued are not announced any more
+    ready = [notification for notification in claimed if notification.order.status == OrderStatus.READY]
+    notified = {order.pk for order in notify(ready)}
+    max_attempts = getattr(settings, 'ORDER_NOTIFICATION_MAX_ATTEMPTS', 20)
+    now = timezone.now()
+    retry = []
+    for notification in ready:
+        order = notification.order
+        if order.pk in notified:
+            continue
+        if order.notification_attempts >= max_attempts:
+            logger.warning('giving up on the ready email of order %s after %d attempts',
+                           order.pk, order.notification_attempts)
+            continue
+        # released for a later run
+        notification.claimed_by = ''
+        notification.claimed_at = None
+        notification.available_at = now + timedelta(seconds=retry_delay(order))
+        retry.append(notification)
+    with transaction.atomic():
+        # orders whose email could not be delivered stay ready, with the failure recorded on them
+        Order.objects.filter(pk__in=notified, status=OrderStatus.READY).update(status=OrderStatus.DONE,
+                                                                                status_changed_at=now)
+        OrderNotification.objects.bulk_update(retry, ['claimed_by', 'claimed_at', 'available_at'])
+        OrderNotification.objects.filter(claimed_by=token).delete()
+    return len(claimed)
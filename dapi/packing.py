@@ -0,0 +1,123 @@
+import json
+import struct
+import zlib
+
+from django.conf import settings
+
+import numpy as np
+
+from . import scoring
+
+# layout: magic, version, flags, then the payload (zlib compressed when COMPRESSED is set)
+# packed payload: gene count, gene offsets (count + 1 uint32) and the bases at 2 bits each
+# raw payload: the submitted text, used when it holds anything besides A, C, G and T
+MAGIC = b'DN'
+VERSION = 1
+COMPRESSED = 0x01
+RAW = 0x02
+
+_HEADER = struct.Struct('<2sBB')
+_COUNT = struct.Struct('<I')
+
+_CODES = np.full(256, 255, dtype=np.uint8)
+_CODES[list(b'ACGT')] = np.arange(4, dtype=np.uint8)
+_LETTERS = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def should_compress(compress):
+    if compress is None:
+        return getattr(settings, 'DNA_PACKING_COMPRESS', True)
+    return compress
+
+
+def _frame(flags, payload, compress):
+    if should_compress(compress):
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            flags |= COMPRESSED
+            payload = compressed
+    return _HEADER.pack(MAGIC, VERSION, flags) + payload
+
+
+def _unframe(data):
+    data = bytes(data)
+    magic, version, flags = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a packed DNA description')
+    payload = data[_HEADER.size:]
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+    return flags, payload
+
+
+def _pack_quads(codes):
+    quads = codes.reshape(-1, 4)
+    return ((quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]).tobytes()
+
+
+def pack_genes(genes, compress=None):
+    offsets = [np.zeros(1, dtype='<u4')]
+    total = 0
+    packed = bytearray()
+    carry = np.zeros(0, dtype=np.uint8)
+    for batch in scoring.batched(genes):
+        buffer, lengths, bounds = scoring.encode(batch)
+        codes = _CODES[buffer]
+        if (codes == 255).any():
+            raise ValueError('only A, C, G and T can be packed')
+        offsets.append((bounds[1:] + total).astype('<u4'))
+        total += int(bounds[-1])
+        # bases that do not fill a whole byte wait for the next batch
+        codes = np.concatenate([carry, codes])
+        whole = len(codes) - len(codes) % 4
+        packed += _pack_quads(codes[:whole])
+        carry = codes[whole:]
+    if len(carry):
+        packed += _pack_quads(np.concatenate([carry, np.zeros(4 - len(carry), dtype=np.uint8)]))
+    offsets = np.concatenate(offsets)
+    payload = _COUNT.pack(len(offsets) - 1) + offsets.tobytes() + bytes(packed)
+    return _frame(0, payload, compress)
+
+
+def pack_buffer(buffer, bounds, compress=None):
+    # same layout as pack_genes for genes that are already encoded into one uint8 buffer
+    codes = _CODES[buffer]
+    if (codes == 255).any():
+        raise ValueError('only A, C, G and T can be packed')
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    payload = _COUNT.pack(len(bounds) - 1) + np.asarray(bounds).astype('<u4').tobytes() + _pack_quads(padded)
+    return _frame(0, payload, compress)
+
+
+def pack_text(text, compress=None):
+    try:
+        return pack_genes(scoring.iter_genes(text), compress)
+    except ValueError:
+        return _frame(RAW, text.encode('utf-8', 'surrogatepass'), compress)
+
+
+def iter_genes(data):
+    if not data:
+        return
+    flags, payload = _unframe(data)
+    if flags & RAW:
+        yield from scoring.iter_genes(payload.decode('utf-8', 'surrogatepass'))
+        return
+    count, = _COUNT.unpack_from(payload)
+    start = _COUNT.size + 4 * (count + 1)
+    offsets = np.frombuffer(payload, dtype='<u4', count=count + 1, offset=_COUNT.size).tolist()
+    packed = np.frombuffer(payload, dtype=np.uint8, offset=start)
+    codes = np.stack([packed >> 6, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3], axis=1).ravel()
+    bases = _LETTERS[codes[:offsets[-1]]].tobytes().decode('ascii')
+    for begin, end in zip(offsets, offsets[1:]):
+        yield bases[begin:end]
+
+
+def unpack_text(data):
+    if not data:
+        return ''
+    flags, payload = _unframe(data)
+    if flags & RAW:
+        return payload.decode('utf-8', 'surrogatepass')
+    return json.dumps(list(iter_genes(data)))
@@ -0,0 +1,30 @@
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # lines are handed out one at a time as (line number, text), blank lines are skipped
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        return ((number, line.decode(encoding)) for number, line in enumerate(stream, 1) if line.strip())
+
+
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # rows are handed out one at a time as (line number, dict keyed by the header row)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        reader = csv.DictReader(codecs.iterdecode(stream, encoding))
+        return ((reader.line_num, row) for row in reader)
@@ -1,13 +1,98 @@
-from .models import Order
+import logging
+import os
+import sys
+import tempfile
 
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from apscheduler.schedulers.background import BackgroundScheduler
 
-def check_ready_and_send_email():
+from .leader import LeaderLock
+from . import outbox, jobs
+
+logger = logging.getLogger(__name__)
+
+ELECTION_JOB = 'leader-election'
+NOTIFICATIONS_JOB = 'order-notifications'
+SERVER_COMMANDS = ('runserver', 'gunicorn', 'uvicorn', 'daphne', 'uwsgi', 'hypercorn')
+
+_scheduler = None
+_lock = None
+
+
+def send_ready_notifications():
+    # drains the outbox batch by batch, then stays paused until something is queued again
+    try:
+        while outbox.process():
+            pass
+    except Exception:
+        logger.exception('sending order notifications failed')
+    else:
+        _scheduler.pause_job(NOTIFICATIONS_JOB)
+        # a notification queued while the job was pausing itself would otherwise wait for the sweep
+        if outbox.pending().exists():
+            resume_notifications()
+    finally:
+        connections.close_all()
+
+
+def sweep_outbox():
+    # catches notifications queued by other processes, and claims left behind by a processor that died
+    try:
+        if outbox.pending().exists():
+            resume_notifications()
+    finally:
+        connections.close_all()
+
+
+def recover_jobs():
+    # DNA scoring jobs lost with the process that had them queued or running are submitted again
     try:
-        orders = Order.objects.filter(status='ready')
-        for order in orders:
-            email = order.customer.email
-            print(email)
-            order.status = 'done'
-            order.save()
-    except:
-        pass
+        jobs.recover_stale_jobs()
+    except Exception:
+        logger.exception('recovering DNA scoring jobs failed')
+    finally:
+        connections.close_all()
+
+
+def resume_notifications():
+    if _scheduler is not None:
+        _scheduler.resume_job(NOTIFICATIONS_JOB)
+
+
+def is_server_process(argv=None):
+    argv = sys.argv if argv is None else argv
+    return any(part in SERVER_COMMANDS for arg in argv[:2] for part in arg.split(os.sep))
+
+
+def should_schedule():
+    enabled = getattr(settings, 'SCHEDULER_ENABLED', None)
+    if enabled is None:
+        return is_server_process()
+    return enabled
+
+
+def elect():
+    # every candidate retries until it holds the lock, so another process takes over when the leader dies
+    if not _lock.acquire():
+        return
+    logger.info('process %s runs the periodic jobs', os.getpid())
+    _scheduler.remove_job(ELECTION_JOB)
+    _scheduler.add_job(send_ready_notifications, 'interval', id=NOTIFICATIONS_JOB,
+                       seconds=getattr(settings, 'ORDER_NOTIFICATION_INTERVAL', 1))
+    _scheduler.add_job(sweep_outbox, 'interval', seconds=getattr(settings, 'ORDER_NOTIFICATION_SWEEP', 30))
+    _scheduler.add_job(recover_jobs, 'interval', seconds=getattr(settings, 'DNA_JOB_RECOVERY_INTERVAL', 60))
+    outbox.set_waker(resume_notifications)
+
+
+def start_scheduler():
+    global _scheduler, _lock
+    if _scheduler is not None or not should_schedule():
+        return
+    _lock = LeaderLock(getattr(settings, 'SCHEDULER_LOCK_FILE',
+                               os.path.join(tempfile.gettempdir(), 'genessite-scheduler.lock')))
+    _scheduler = BackgroundScheduler()
+    _scheduler.add_job(elect, 'interval', id=ELECTION_JOB, next_run_time=timezone.now(),
+                       seconds=getattr(settings, 'SCHEDULER_LEADER_RETRY', 10))
+    _scheduler.start()
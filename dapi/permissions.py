@@ -11,3 +11,10 @@ class IsSuperUserOrOwner(permissions.BasePermission):
         if request.user.is_superuser:
             return True
         return request.user.id == obj.id
+
+
+class IsSuperUserOrCustomer(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        if request.user.is_superuser:
+            return True
+        return request.user.id == obj.customer_id
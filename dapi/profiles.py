@@ -0,0 +1,77 @@
+import struct
+
+from django.conf import settings
+
+import numpy as np
+
+from . import scoring
+
+# layout: magic, version, value type, window, gene count, then gene offsets (count + 1 uint32) and the values
+# windows of up to 255 bases keep their exact GC counts as uint8, wider ones keep float16 ratios
+MAGIC = b'GP'
+VERSION = 1
+COUNTS = 0
+RATIOS = 1
+
+_HEADER = struct.Struct('<2sBBII')
+_DTYPES = {COUNTS: np.uint8, RATIOS: np.float16}
+
+_GC = np.zeros(256, dtype=bool)
+_GC[list(b'GC')] = True
+
+
+def get_window(window=None):
+    return window or getattr(settings, 'DNA_GC_WINDOW', 50)
+
+
+def gc_windows(buffer, bounds, window):
+    # GC count of every window that fits in a gene, from a single cumulative sum over the joined buffer,
+    # so the work per gene does not depend on the window size
+    totals = np.zeros(len(buffer) + 1, dtype=np.int64)
+    np.cumsum(_GC[buffer], out=totals[1:])
+    windows = np.maximum(np.diff(bounds) - window + 1, 0)
+    offsets = np.zeros(len(windows) + 1, dtype=np.int64)
+    np.cumsum(windows, out=offsets[1:])
+    starts = np.repeat(bounds[:-1] - offsets[:-1], windows) + np.arange(offsets[-1])
+    return offsets, totals[starts + window] - totals[starts]
+
+
+def gc_profile(genes, window=None):
+    window = get_window(window)
+    value_type = COUNTS if window <= 255 else RATIOS
+    offsets = [np.zeros(1, dtype='<u4')]
+    values = []
+    count = total = 0
+    for batch in scoring.batched(genes):
+        buffer, lengths, bounds = scoring.encode(batch)
+        batch_offsets, counts = gc_windows(buffer, bounds, window)
+        offsets.append((batch_offsets[1:] + total).astype('<u4'))
+        total += int(batch_offsets[-1])
+        count += len(batch)
+        if value_type == COUNTS:
+            values.append(counts.astype(np.uint8))
+        else:
+            values.append((counts / window).astype('<f2'))
+    values = np.concatenate(values) if values else np.zeros(0, dtype=_DTYPES[value_type])
+    return _HEADER.pack(MAGIC, VERSION, value_type, window, count) + np.concatenate(offsets).tobytes() + \
+        values.tobytes()
+
+
+def read_profile(data):
+    # returns the window, the value type, the gene offsets and the raw values
+    data = bytes(data)
+    magic, version, value_type, window, count = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a GC profile')
+    offsets = np.frombuffer(data, dtype='<u4', count=count + 1, offset=_HEADER.size)
+    values = np.frombuffer(data, dtype=_DTYPES[value_type], offset=_HEADER.size + offsets.nbytes)
+    return window, value_type, offsets, values
+
+
+def ratios(data):
+    window, value_type, offsets, values = read_profile(data)
+    if value_type == COUNTS:
+        values = values / window
+    values = np.round(values.astype(np.float64), 4).tolist()
+    offsets = offsets.tolist()
+    return [values[begin:end] for begin, end in zip(offsets, offsets[1:])]
@@ -0,0 +1,12 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    # picked with ?format=stream, the view hands it the rows one at a time and the list is written as they come
+    format = 'stream'
+
+    def stream(self, rows):
+        yield b'['
+        for number, row in enumerate(rows):
+            yield (b',' if number else b'') + super().render(row)
+        yield b']'
@@ -0,0 +1,46 @@
+import base64
+
+from rest_framework import serializers
+
+import numpy as np
+
+from . import scoring
+
+FULL = 'full'
+BITMAP = 'bitmap'
+RUNS = 'runs'
+# per-gene metrics from scoring.dna_report, built from the genes rather than the reason codes
+REPORT = 'report'
+FORMATS = (FULL, BITMAP, RUNS, REPORT)
+
+
+def requested_format(request):
+    result_format = request.query_params.get('result_format', FULL) if request is not None else FULL
+    if result_format not in FORMATS:
+        raise serializers.ValidationError({"result_format": "result_format should be one of " + ", ".join(FORMATS)})
+    return result_format
+
+
+def invalid_runs(invalid):
+    edges = np.diff(np.concatenate(([0], invalid.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    return np.stack([starts, np.flatnonzero(edges == -1) - starts], axis=1).tolist()
+
+
+def encode_results(reasons, result_format=FULL):
+    if result_format == FULL:
+        return scoring.verdict_strings(reasons)
+    codes = np.frombuffer(bytes(reasons), dtype=np.uint8)
+    invalid = codes != scoring.VALID
+    encoded = {
+        'format': result_format,
+        'count': len(codes),
+        # reason codes of the failing genes only, in gene order
+        'reasons': base64.b64encode(codes[invalid].tobytes()).decode('ascii'),
+        'reason_codes': scoring.REASONS,
+    }
+    if result_format == BITMAP:
+        encoded['invalid'] = base64.b64encode(np.packbits(invalid).tobytes()).decode('ascii')
+    else:
+        encoded['invalid'] = invalid_runs(invalid)
+    return encoded
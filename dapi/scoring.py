@@ -0,0 +1,293 @@
+import hashlib
+import re
+from json.decoder import scanstring
+from multiprocessing import resource_tracker, shared_memory
+
+from django.conf import settings
+
+import numpy as np
+
+from . import verdict_cache
+
+# bump when the rules change in a way the parameters below do not show, cached verdicts depend on it
+RULES_VERSION = 2
+MIN_GENE_LENGTH = 10  # 10 instead of 300 for testing
+MAX_GENE_LENGTH = 5000
+GC_LOW = 0.25
+GC_HIGH = 0.65
+
+# engines give one reason code per gene, 0 for a valid gene
+VALID = 0
+BAD_LENGTH = 1
+BAD_ALPHABET = 2
+LOW_GC = 3
+HIGH_GC = 4
+DUPLICATE = 5
+REASONS = {
+    BAD_LENGTH: 'length',
+    BAD_ALPHABET: 'alphabet',
+    LOW_GC: 'gc_low',
+    HIGH_GC: 'gc_high',
+    DUPLICATE: 'duplicate',
+}
+
+PYTHON_ENGINE = 'python'
+NUMPY_ENGINE = 'numpy'
+
+_BASES = np.zeros(256, dtype=bool)
+_BASES[list(b'ATGC')] = True
+_GC = np.zeros(256, dtype=bool)
+_GC[list(b'GC')] = True
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def python_gene_reason(gene):
+    if len(gene) < MIN_GENE_LENGTH or len(gene) > MAX_GENE_LENGTH:
+        return BAD_LENGTH
+    if not all(ch in "ATGC" for ch in gene):
+        return BAD_ALPHABET
+    ratio = (gene.count('G') + gene.count('C')) * 1.0 / len(gene)
+    if ratio <= GC_LOW:
+        return LOW_GC
+    if ratio >= GC_HIGH:
+        return HIGH_GC
+    return VALID
+
+
+def python_gene_scoring(gene):
+    return python_gene_reason(gene) == VALID
+
+
+def python_engine(genes):
+    return bytes(python_gene_reason(gene) for gene in genes)
+
+
+def segment_sums(mask, bounds):
+    # per-gene totals of a boolean mask over the joined buffer, empty genes included
+    totals = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=totals[1:])
+    return totals[bounds[1:]] - totals[bounds[:-1]]
+
+
+def encode(genes):
+    lengths = np.fromiter((len(gene) for gene in genes), dtype=np.int64, count=len(genes))
+    bounds = np.zeros(len(genes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=bounds[1:])
+    # non ascii characters become a single '?' so offsets keep counting characters
+    buffer = np.frombuffer(''.join(genes).encode('ascii', errors='replace'), dtype=np.uint8)
+    return buffer, lengths, bounds
+
+
+def scan(genes):
+    buffer, lengths, bounds = encode(genes)
+    return scan_buffer(buffer, bounds)
+
+
+def scan_buffer(buffer, bounds):
+    # one pass over the joined buffer gives every metric for every gene
+    lengths = np.diff(bounds)
+    starts = bounds[:-1]
+    nonempty = lengths > 0
+
+    invalid = np.flatnonzero(~_BASES[buffer])
+    invalid_at = np.full(len(lengths), -1, dtype=np.int64)
+    if len(invalid):
+        owners, first = np.unique(np.searchsorted(bounds, invalid, side='right') - 1, return_index=True)
+        invalid_at[owners] = invalid[first] - starts[owners]
+
+    gc = segment_sums(_GC[buffer], bounds)
+    ratio = np.divide(gc, lengths, out=np.zeros(len(lengths)), where=nonempty)
+
+    # a run of the same base starts at every gene start and wherever the base changes
+    boundary = np.ones(len(buffer), dtype=bool)
+    boundary[1:] = buffer[1:] != buffer[:-1]
+    boundary[starts[nonempty]] = True
+    run_starts = np.flatnonzero(boundary)
+    run_lengths = np.diff(np.append(run_starts, len(buffer)))
+    max_homopolymer = np.zeros(len(lengths), dtype=np.int64)
+    if nonempty.any():
+        max_homopolymer[nonempty] = np.maximum.reduceat(run_lengths, np.searchsorted(run_starts, starts[nonempty]))
+
+    # later assignments win, so the checks go from the last one the python engine makes to the first
+    reasons = np.zeros(len(lengths), dtype=np.uint8)
+    reasons[ratio >= GC_HIGH] = HIGH_GC
+    reasons[ratio <= GC_LOW] = LOW_GC
+    reasons[invalid_at >= 0] = BAD_ALPHABET
+    reasons[(lengths < MIN_GENE_LENGTH) | (lengths > MAX_GENE_LENGTH)] = BAD_LENGTH
+    return {
+        'length': lengths,
+        'invalid_at': invalid_at,
+        'gc': gc,
+        'max_homopolymer': max_homopolymer,
+        'reason': reasons,
+    }
+
+
+def numpy_engine(genes):
+    if not genes:
+        return b''
+    return scan(genes)['reason'].tobytes()
+
+
+ENGINES = {
+    PYTHON_ENGINE: python_engine,
+    NUMPY_ENGINE: numpy_engine,
+}
+
+
+def get_engine(name=None):
+    if name is None:
+        name = getattr(settings, 'DNA_SCORING_ENGINE', NUMPY_ENGINE)
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError('unknown DNA scoring engine: %s' % name)
+
+
+def iter_genes(text):
+    # yields the genes of a JSON list one at a time instead of building the whole list
+    pos = _WHITESPACE.match(text, 0).end()
+    if text[pos:pos + 1] != '[':
+        raise ValueError('DNA must be a list of genes')
+    pos = _WHITESPACE.match(text, pos + 1).end()
+    if text[pos:pos + 1] != ']':
+        while True:
+            if text[pos:pos + 1] != '"':
+                raise ValueError('genes must be strings')
+            gene, pos = scanstring(text, pos + 1)
+            yield gene
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] == ']':
+                break
+            if text[pos:pos + 1] != ',':
+                raise ValueError('expected , or ] at %d' % pos)
+            pos = _WHITESPACE.match(text, pos + 1).end()
+    if _WHITESPACE.match(text, pos + 1).end() != len(text):
+        raise ValueError('extra data after the list of genes')
+
+
+def batched(genes, size=None):
+    if size is None:
+        size = getattr(settings, 'DNA_SCORING_CHUNK', 1000)
+    batch = []
+    for gene in genes:
+        batch.append(gene)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def score_batches(batches, engine):
+    cache = verdict_cache.get_verdict_cache()
+    for batch in batches:
+        if cache is None:
+            yield batch, engine(batch)
+        else:
+            yield batch, cache.score(batch, engine)
+
+
+def fingerprint(gene):
+    # 64-bit signed so it fits a BigIntegerField, used for duplicates, the verdict cache and the gene index
+    return fingerprint_bytes(gene.encode('utf-8', 'surrogatepass'))
+
+
+def fingerprint_bytes(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)
+
+
+def merge_reasons(reasons, batch_reasons, keys, seen):
+    # appends a batch of reasons and marks genes whose fingerprint was seen before as duplicates,
+    # returns False when anything in the batch failed
+    start = len(reasons)
+    reasons.extend(batch_reasons)
+    is_valid = not any(batch_reasons)
+    for i, key in enumerate(keys, start):
+        if key in seen:
+            is_valid = False
+            if reasons[i] == VALID:
+                reasons[i] = DUPLICATE
+        seen.add(key)
+    return is_valid
+
+
+def tally(scored, fail_fast=False):
+    is_valid = True
+    seen = set()
+    reasons = bytearray()
+    number_of_proteins = 0
+    for batch, batch_reasons in scored:
+        number_of_proteins += sum(map(len, batch))
+        if not merge_reasons(reasons, batch_reasons, map(fingerprint, batch), seen):
+            is_valid = False
+        if fail_fast and not is_valid:
+            break
+    return is_valid, reasons, number_of_proteins
+
+
+def scan_shared(buffer_name, bounds_name, size, count, first, last, own_tracker=False):
+    # runs in a pool worker, scans genes first..last-1 straight from the parent's shared memory
+    buffer_memory = shared_memory.SharedMemory(name=buffer_name)
+    bounds_memory = shared_memory.SharedMemory(name=bounds_name)
+    if own_tracker:
+        # the parent owns the segments, otherwise this worker's tracker would unlink them as well
+        resource_tracker.unregister(buffer_memory._name, 'shared_memory')
+        resource_tracker.unregister(bounds_memory._name, 'shared_memory')
+    try:
+        bounds = np.ndarray(count + 1, dtype=np.int64, buffer=bounds_memory.buf)
+        buffer = np.ndarray(size, dtype=np.uint8, buffer=buffer_memory.buf)
+        begin, end = int(bounds[first]), int(bounds[last])
+        reasons = scan_buffer(buffer[begin:end], bounds[first:last + 1] - begin)['reason'].tobytes()
+        del bounds, buffer
+        return reasons
+    finally:
+        buffer_memory.close()
+        bounds_memory.close()
+
+
+def verdict_strings(reasons):
+    # duplicates only fail the submission, per gene they have always been reported as valid
+    return ["valid" if reason in (VALID, DUPLICATE) else "invalid" for reason in reasons]
+
+
+def dna_reasons(dna, engine=None):
+    return tally(score_batches(batched(dna), get_engine(engine)))
+
+
+def dna_scoring(dna, engine=None):
+    is_valid, reasons, number_of_proteins = dna_reasons(dna, engine)
+    return is_valid, verdict_strings(reasons), number_of_proteins
+
+
+def dna_report(dna):
+    # per-gene metrics and reason names, scanned again without the verdict cache
+    scans = []
+
+    def scanned():
+        for batch in batched(dna):
+            gene_scan = scan(batch)
+            scans.append(gene_scan)
+            yield batch, gene_scan['reason'].tobytes()
+
+    is_valid, reasons, number_of_proteins = tally(scanned())
+    report = []
+    for gene_scan in scans:
+        columns = [gene_scan[name].tolist() for name in ('length', 'invalid_at', 'gc', 'max_homopolymer')]
+        for length, invalid_at, gc, max_homopolymer in zip(*columns):
+            reason = reasons[len(report)]
+            report.append({
+                'reason': REASONS.get(reason, 'valid'),
+                'length': length,
+                'invalid_at': invalid_at if invalid_at >= 0 else None,
+                'gc_ratio': gc / length if length else None,
+                'max_homopolymer': max_homopolymer,
+            })
+    return is_valid, report, number_of_proteins
+
+
+def dna_verdict(dna, engine=None):
+    # stops at the first failing batch, returns the verdict, gene count and protein total
+    is_valid, reasons, number_of_proteins = tally(score_batches(batched(dna), get_engine(engine)), fail_fast=True)
+    return is_valid, len(reasons), number_of_proteins
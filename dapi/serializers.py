@@ -1,10 +1,20 @@
+import base64
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
-from .models import Product, Order, DNAService
-
-import json
+from .models import Product, Order, OrderStatus, DNAService, ORDER_TRANSITIONS
+from .filters import OrderFilter
+from .results import FULL, REPORT, encode_results, requested_format
+from .gene_index import get_gene_index
+from .catalog import get_product_cache
+from .authentication import in_group
+from . import scoring, jobs, fasta, packing, profiles, kmers, outbox, hashing
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -30,13 +40,16 @@ class RegisterSerializer(serializers.ModelSerializer):
             Group.objects.get(name=attrs['group'])
         except:
             raise serializers.ValidationError({"group": "invalid group"})
+        self.check_creator(attrs)
+        return attrs
+
+    def check_creator(self, attrs):
         user = self.context['request'].user
         if not user.is_superuser:
             if attrs['group'] != 'customer':
                 raise serializers.ValidationError({"user": "user not allow to create this type of users"})
-            elif not (user.groups.filter(name='orgs').exists()):  # user must be an org to create customers
+            elif not in_group(user, 'orgs'):  # user must be an org to create customers
                 raise serializers.ValidationError({"user": "user not allow to create this type of users"})
-        return attrs
 
     def create(self, validated_data):
         if validated_data['group'] == 'staff':
@@ -54,12 +67,35 @@ class RegisterSerializer(serializers.ModelSerializer):
                 last_name=validated_data['last_name']
             )
 
-        user.set_password(validated_data['password'])
+        user.password = hashing.make_password(validated_data['password'])
         user.save()
         Group.objects.get(name=validated_data['group']).user_set.add(user)
         return user
 
 
+class BulkUserSerializer(RegisterSerializer):
+    # uniqueness is checked by the import for all rows at once and the groups come from the context
+    email = serializers.EmailField(required=True)
+
+    class Meta(RegisterSerializer.Meta):
+        extra_kwargs = dict(RegisterSerializer.Meta.extra_kwargs, username={'validators': [UnicodeUsernameValidator()]})
+
+    def validate(self, attrs):
+        if attrs['password'] != attrs['password2']:
+            raise serializers.ValidationError({"password": "password fields didn't match"})
+        if attrs['group'] not in self.context['groups']:
+            raise serializers.ValidationError({"group": "invalid group"})
+        self.check_creator(attrs)
+        return attrs
+
+    @staticmethod
+    def build_user(validated_data, password):
+        staff = validated_data['group'] == 'staff'
+        return User(username=validated_data['username'], email=validated_data['email'],
+                    first_name=validated_data['first_name'], last_name=validated_data['last_name'],
+                    password=password, is_staff=staff, is_superuser=staff)
+
+
 class UpdateUserSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(required=True)
 
@@ -118,7 +154,7 @@ class ChangePasswordSerializer(serializers.ModelSerializer):
     def validate_old_password(self, value):
         user = self.context['request'].user
         if not user.is_superuser:
-            if not user.check_password(value):
+            if not hashing.check_user_password(user, value):
                 raise serializers.ValidationError({"old_password": "Old password is not correct"})
         return value
 
@@ -129,7 +165,7 @@ class ChangePasswordSerializer(serializers.ModelSerializer):
             if user.pk != instance.pk:
                 raise serializers.ValidationError({"authorize": "you don't have permissions to do this"})
 
-        instance.set_password(validated_data['password'])
+        instance.password = hashing.make_password(validated_data['password'])
         instance.save()
 
         return instance
@@ -157,7 +193,7 @@ class ActivateUserSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"authorize": "you don't have permissions to do this"})
             if not user.is_active:
                 raise serializers.ValidationError({"user": "you can't Activate your account ask a staff to do that"})
-            if not instance.check_password(validated_data['password']):
+            if not hashing.check_user_password(instance, validated_data['password']):
                 raise serializers.ValidationError({"password": "wrong password"})
 
         a_user = User.objects.get(pk=instance.pk)
@@ -223,53 +259,96 @@ class CreateOrderSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def validate_product_id(value):
-        try:
-            Product.objects.get(pk=value)
-        except:
+        if get_product_cache().get(value) is None:
             raise serializers.ValidationError({"product": "invalid product id"})
         return value
 
+    @staticmethod
+    def build_order(validated_data, customer, product, is_superuser):
+        order = Order()
+        order.customer = customer
+        order.product = product
+        order.number = validated_data['number']
+        order.total_price = product.price * validated_data['number']
+        if is_superuser:
+            order.total_price = validated_data.get('total_price', order.total_price)
+            order.status = validated_data.get('status', order.status)
+        order.order_description = validated_data.get('order_description', '')
+        return order
+
     def create(self, validated_data):
         user = self.context['request'].user
+        is_superuser = user.is_superuser
 
-        if not user.is_superuser:
-            order = Order.objects.create(
-                product=Product.objects.get(pk=validated_data['product_id']),
-                customer=user,
-                number=validated_data['number'],
-                status='waiting',
-                total_price=Product.objects.get(pk=validated_data['product_id']).price * validated_data['number']
-            )
-        else:
+        if is_superuser:
             try:
                 user = User.objects.get(pk=validated_data['customer_id'])
             except:
                 raise serializers.ValidationError({"user": "super users must provide valid customer"})
 
-            order = Order()
-            order.customer = user
-            order.product = Product.objects.get(pk=validated_data['product_id'])
-            order.number = validated_data['number']
-            try:
-                order.total_price = validated_data['total_price']
-            except:
-                order.total_price = Product.objects.get(pk=validated_data['product_id']).price * validated_data[
-                    'number']
-
-            try:
-                status = validated_data['status']
-                order.status = status
-            except:
-                pass
-        try:
-            order.order_description = validated_data['order_description']
-        except:
-            order.order_description = ''
+        order = self.build_order(validated_data, user, get_product_cache().get(validated_data['product_id']),
+                                 is_superuser)
         order.save()
 
         return order
 
 
+class BulkOrderSerializer(CreateOrderSerializer):
+
+    @staticmethod
+    def validate_product_id(value):
+        # the bulk view looks every product of the request up at once
+        return value
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.product_name')
+    customer = serializers.CharField(source='customer.username')
+
+    class Meta:
+        model = Order
+        fields = ['id', 'product_id', 'product_name', 'customer_id', 'customer', 'number', 'total_price', 'status',
+                  'order_description', 'notification_status', 'notified_at']
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=list(ORDER_TRANSITIONS))
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    filter = serializers.DictField(required=False)
+
+    @staticmethod
+    def validate_filter(value):
+        # OrderFilter ignores keys it does not know, an empty or misspelled filter would move every order
+        if not value:
+            raise serializers.ValidationError("the filter can't be empty")
+        unknown = sorted(set(value) - set(OrderFilter.base_filters))
+        if unknown:
+            raise serializers.ValidationError("unknown filters: %s" % ', '.join(unknown))
+        return value
+
+    def validate(self, attrs):
+        if 'ids' not in attrs and 'filter' not in attrs:
+            raise serializers.ValidationError({"orders": "provide ids or a filter"})
+        return attrs
+
+    def apply(self):
+        # one conditional UPDATE, orders that cannot move to the status are left as they are
+        status = self.validated_data['status']
+        queryset = Order.objects.all()
+        if 'ids' in self.validated_data:
+            queryset = queryset.filter(pk__in=self.validated_data['ids'])
+        if 'filter' in self.validated_data:
+            filterset = OrderFilter(self.validated_data['filter'], queryset=queryset)
+            if not filterset.is_valid():
+                raise serializers.ValidationError({"filter": filterset.errors})
+            queryset = filterset.qs
+        queryset = queryset.filter(status__in=ORDER_TRANSITIONS[status])
+        with transaction.atomic():
+            if status == OrderStatus.READY:
+                outbox.enqueue_queryset(queryset)
+            return queryset.update(status=status, status_changed_at=timezone.now())
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField(required=False)
     customer_id = serializers.IntegerField(required=False)
@@ -298,10 +377,10 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         except:
             pass
 
-        try:
-            instance.product = Product.objects.get(pk=validated_data['product_id'])
-        except:
-            pass
+        if 'product_id' in validated_data:
+            product = get_product_cache().get(validated_data['product_id'])
+            if product is not None:
+                instance.product = product
 
         try:
             instance.number = validated_data['number']
@@ -317,72 +396,209 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         return instance
 
 
+def resolve_customer(user, validated_data):
+    if user.is_superuser:
+        try:
+            return User.objects.get(pk=validated_data['customer_id'])
+        except:
+            raise serializers.ValidationError({"user": "super users have to provide valid customer_id"})
+    return user
+
+
+class InvalidDNA(serializers.ValidationError):
+    def __init__(self, results):
+        super().__init__()
+        # set directly, ValidationError would turn the numbers of the compact formats into strings
+        self.detail = {"status": "invalid DNA", "results": results}
+
+
 class CreateDNAScoringServiceSerializer(serializers.ModelSerializer):
     customer_id = serializers.IntegerField(required=False)
+    service_description = serializers.CharField(required=True)
+    asynchronous = serializers.BooleanField(required=False, default=False, write_only=True)
+    window = serializers.IntegerField(source='gc_window', required=False, min_value=1,
+                                      max_value=scoring.MAX_GENE_LENGTH)
+    k = serializers.IntegerField(source='kmer_size', required=False, min_value=1, max_value=kmers.MAX_K)
 
     class Meta:
         model = DNAService
-        fields = ['customer_id', 'service_description', 'number', 'status', 'type']
+        fields = ['id', 'customer_id', 'service_description', 'number', 'status', 'type', 'repeated_genes',
+                  'asynchronous', 'window', 'k']
+        read_only_fields = ['repeated_genes']
         extra_kwargs = {
             'number': {'required': False},
             'type': {'required': False},
-            'status': {'required': False},
-            'service_description': {'required': True}
+            'status': {'required': False}
         }
 
+    @staticmethod
+    def validate_service_description(value):
+        # read per request rather than as max_length so the limit follows the settings
+        max_length = getattr(settings, 'DNA_MAX_DESCRIPTION_LENGTH', 10000000)
+        if max_length and len(value) > max_length:
+            raise serializers.ValidationError(f"Ensure this field has no more than {max_length} characters.")
+        return value
+
     @staticmethod
     def gene_scoring(gene):
-        if len(gene) < 10 or len(gene) > 5000:  # 10 instead of 300 for testing
-            return False
-        if not all(ch in "ATGC" for ch in gene):
-            return False
-        ratio = (gene.count('G') + gene.count('C')) * 1.0 / len(gene)
-        if ratio <= 0.25 or ratio >= 0.65:
-            return False
-        return True
+        return scoring.python_gene_scoring(gene)
 
     @staticmethod
-    def dna_scoring(dna):
-        is_valid = True
-        if len(dna) > len(set(dna)):
-            is_valid = False
-        results = []
-        valid_count = 0
-        number_of_proteins = 0
-        for gene in dna:
-            number_of_proteins += len(gene)
-            if CreateDNAScoringServiceSerializer.gene_scoring(gene):
-                results.append("valid")
-                valid_count += 1
+    def dna_scoring(dna, engine=None):
+        return scoring.dna_scoring(dna, engine)
+
+    def score_description(self, validated_data):
+        text = validated_data['service_description']
+        result_format = requested_format(self.context.get('request'))
+        try:
+            reasons = None
+            if validated_data['asynchronous']:
+                # scoring happens in the job, only the cheap checks run in the request
+                is_valid = True
+                gene_count = number_of_proteins = 0
+                for gene in scoring.iter_genes(text):
+                    gene_count += 1
+                    number_of_proteins += len(gene)
+            elif jobs.should_run_parallel(len(text)):
+                is_valid, reasons, number_of_proteins = jobs.parallel_reasons(scoring.iter_genes(text))
+                gene_count = len(reasons)
             else:
-                results.append("invalid")
-        if len(dna) > valid_count:
-            is_valid = False
+                is_valid, gene_count, number_of_proteins = scoring.dna_verdict(scoring.iter_genes(text))
+            if not is_valid:
+                if result_format == REPORT:
+                    is_valid, report, number_of_proteins = scoring.dna_report(scoring.iter_genes(text))
+                    raise InvalidDNA(report)
+                if reasons is None:
+                    # the verdict stops early, the per-gene results need a full pass
+                    is_valid, reasons, number_of_proteins = scoring.dna_reasons(scoring.iter_genes(text))
+                raise InvalidDNA(encode_results(reasons, result_format))
+        except ValueError:
+            raise serializers.ValidationError({"service_description": "service description must be a list of genes"})
+        return gene_count, number_of_proteins
+
+    @staticmethod
+    def build_service(validated_data, customer, gene_count, number_of_proteins):
+        service = DNAService()
+        service.type = validated_data.get('type', DNAService.ServiceType.DNA_SCORING)
+        service.customer = customer
+        service.number = number_of_proteins
+        service.service_description = validated_data['service_description']
+        service.gene_count = gene_count
+        if service.type == DNAService.ServiceType.GC_PROFILE:
+            service.gc_window = profiles.get_window(validated_data.get('gc_window'))
+        elif service.type == DNAService.ServiceType.KMER_COUNT:
+            service.kmer_size = kmers.get_k(validated_data.get('kmer_size'))
+        if not validated_data['asynchronous']:
+            service.scored_genes = gene_count
+            service.is_valid = True
+            service.analyse()
+        return service
+
+    def create(self, validated_data):
+        user = self.context['request'].user
 
-        return is_valid, results, number_of_proteins
+        gene_count, number_of_proteins = self.score_description(validated_data)
+
+        user = resolve_customer(user, validated_data)
+        service = self.build_service(validated_data, user, gene_count, number_of_proteins)
+        service.save()
+        if validated_data['asynchronous']:
+            jobs.submit(service)
+        else:
+            get_gene_index().record(service)
+        return service
+
+
+class FastaDNAScoringServiceSerializer(serializers.ModelSerializer):
+    customer_id = serializers.IntegerField(required=False)
+    file = serializers.FileField(write_only=True)
+
+    class Meta:
+        model = DNAService
+        fields = ['id', 'customer_id', 'file', 'number', 'status', 'type', 'repeated_genes']
+        read_only_fields = ['number', 'status', 'type', 'repeated_genes']
 
     def create(self, validated_data):
         user = self.context['request'].user
+        result_format = requested_format(self.context.get('request'))
 
-        is_valid, results, number_of_proteins = self.dna_scoring(json.loads(validated_data['service_description']))
+        try:
+            sequence, bounds = fasta.parse_upload(validated_data['file'])
+        except ValueError:
+            raise serializers.ValidationError({"file": "file must be in FASTA format"})
 
+        keys = fasta.fingerprints(sequence, bounds)
+        is_valid, reasons, number_of_proteins = fasta.score(sequence, bounds, keys)
         if not is_valid:
-            raise serializers.ValidationError({"status": "invalid DNA", "results": results})
+            if result_format == REPORT:
+                raise InvalidDNA(scoring.dna_report(fasta.iter_genes(sequence, bounds))[1])
+            raise InvalidDNA(encode_results(reasons, result_format))
 
-        if user.is_superuser:
-            try:
-                user = User.objects.get(pk=validated_data['customer_id'])
-            except:
-                raise serializers.ValidationError({"user": "super users have to provide valid customer_id"})
+        user = resolve_customer(user, validated_data)
         service = DNAService()
-        service.ServiceType = 'dna_scoring'
         service.customer = user
         service.number = number_of_proteins
-        service.service_description = validated_data['service_description']
+        service.packed_description = packing.pack_buffer(sequence, bounds)
+        service.gene_count = service.scored_genes = len(keys)
+        service.is_valid = True
         service.save()
+        get_gene_index().record_fingerprints(service, keys)
         return service
 
 
+class DNAServiceStatusSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    results = serializers.SerializerMethodField()
+    profile = serializers.SerializerMethodField()
+    window = serializers.IntegerField(source='gc_window')
+    k = serializers.IntegerField(source='kmer_size')
+    kmers = serializers.SerializerMethodField()
+    total_price = serializers.FloatField()
+
+    class Meta:
+        model = DNAService
+        fields = ['id', 'type', 'status', 'number', 'total_price', 'gene_count', 'scored_genes', 'progress',
+                  'is_valid', 'job_error', 'repeated_genes', 'window', 'k', 'results', 'profile', 'kmers']
+
+    @staticmethod
+    def get_progress(obj):
+        if not obj.gene_count:
+            return 1.0
+        return obj.scored_genes / obj.gene_count
+
+    def get_results(self, obj):
+        result_format = requested_format(self.context.get('request'))
+        if result_format == REPORT:
+            return scoring.dna_report(obj.genes())[1]
+        # a valid submission has only valid genes, so reasons are only stored for invalid ones
+        reasons = bytes(obj.gene_count) if obj.is_valid else obj.reasons
+        return encode_results(reasons, result_format)
+
+    def get_profile(self, obj):
+        if not obj.gc_profile:
+            return None
+        if requested_format(self.context.get('request')) == FULL:
+            return profiles.ratios(obj.gc_profile)
+        window, value_type, offsets, values = profiles.read_profile(obj.gc_profile)
+        return {
+            'values': 'counts' if value_type == profiles.COUNTS else 'ratios',
+            'dtype': values.dtype.name,
+            'offsets': base64.b64encode(offsets.tobytes()).decode('ascii'),
+            'profile': base64.b64encode(values.tobytes()).decode('ascii'),
+        }
+
+    def get_kmers(self, obj):
+        if not obj.kmer_counts:
+            return None
+        if requested_format(self.context.get('request')) == FULL:
+            return kmers.counts_dict(obj.kmer_counts)
+        k, codes, counts = kmers.read_counts(obj.kmer_counts)
+        return {
+            'codes': base64.b64encode(codes.tobytes()).decode('ascii'),
+            'counts': base64.b64encode(counts.tobytes()).decode('ascii'),
+        }
+
+
 class UserDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Product, Order
+from .catalog import VERSION, get_product_cache
+from .authentication import ALL_USERS, user_version
+from . import versions, outbox
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, **kwargs):
+    # this process forgets the catalog right away, the others once the change is committed
+    get_product_cache().clear()
+    transaction.on_commit(lambda: versions.bump_version(VERSION))
+
+
+def bump_versions(names):
+    # bumped right away and again on commit, a request reading the old row in between does not keep it
+    for name in names:
+        versions.bump_version(name)
+    transaction.on_commit(lambda: [versions.bump_version(name) for name in names])
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    bump_versions([user_version(instance.pk)])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_versions([user_version(instance.pk)])
+    elif pk_set:
+        bump_versions([user_version(pk) for pk in pk_set])
+    else:
+        bump_versions([ALL_USERS])
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # orders saved as ready by any path (the API, the admin, scripts) are queued for their email,
+    # bulk_create and queryset updates queue theirs themselves
+    if instance._became_ready:
+        outbox.enqueue([instance])
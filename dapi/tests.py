@@ -1,6 +1,40 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.db import connection
+from django.db.models import F
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.contrib.auth.models import User, Group
+from .models import Product, Order, OrderStatus, OrderNotification, DNAService, GeneFingerprint, VersionCounter
+from . import scoring, packing, jobs, fasta, profiles, kmers, catalog, versions, outbox, periodic_tasks, delivery
+from .leader import LeaderLock
+from .events import get_hub
+from .authentication import get_user_cache, user_version
+from .hashing import HashingBusy, HashingService
+from genessite.asgi import application
+from rest_framework_simplejwt.tokens import RefreshToken
+from .catalog import ProductCache, get_product_cache
+from .gene_index import BloomFilter, GeneIndex, get_gene_index
+from .verdict_cache import VerdictCache
 # Create your tests here.
 
 
@@ -149,6 +183,10 @@ class DNAServicesTests(TestCase):
         response = self.client.post(reverse('token-obtain-pair'), {'username': username, 'password': password})
         return response.json()['access']
 
+    def get_response(self, url, token):
+        return self.client.get(url, format='json',
+                               **{'HTTP_AUTHORIZATION': f'Bearer {token}'}, follow=True)
+
     def post_response(self, url, data, token):
         return self.client.post(url, data=data, format='json',
                                 **{'HTTP_AUTHORIZATION': f'Bearer {token}'}, follow=True)
@@ -162,3 +200,1047 @@ class DNAServicesTests(TestCase):
         response = self.post_response(reverse('add-service'), data, token)
         self.assertEqual(response.status_code, 201)
 
+    def test_add_DNA_scoring_with_invalid_gene(self):
+        make_groups()
+        create_super_user()
+        user = create_user()
+        token = self.get_access_token()
+        data = {"service_description": "[\"ACTGACTGACTG\", \"AAAAAAAAAAAA\"]", "customer_id": user.id}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'], ['valid', 'invalid'])
+
+    @override_settings(DNA_SCORING_WORKERS=0)
+    def test_add_asynchronous_DNA_scoring(self):
+        user = create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "[\"ACTGACTGACTG\", \"AAAAAAAAAAAA\"]", "asynchronous": True}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 202)
+        response = self.get_response(reverse('view-service', args=(response.json()['id'],)), token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+        self.assertEqual(response.json()['progress'], 1.0)
+        self.assertFalse(response.json()['is_valid'])
+        self.assertEqual(response.json()['results'], ['valid', 'invalid'])
+        self.assertEqual(DNAService.objects.get().customer, user)
+
+    def test_view_DNA_service_by_another_user(self):
+        create_user()
+        User.objects.create_user(username='customer2', email=None, password='12345')
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "[\"ACTGACTGACTG\"]"}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 201)
+        token = self.get_access_token(username='customer2', password='12345')
+        response = self.get_response(reverse('view-service', args=(response.json()['id'],)), token)
+        self.assertEqual(response.status_code, 403)
+
+    def test_add_DNA_scoring_with_malformed_description(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "{\"gene\": \"ACTGACTGACTG\"}"}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(DNA_MAX_DESCRIPTION_LENGTH=100)
+    def test_add_DNA_scoring_with_oversized_description(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": json.dumps(["ACTGACTGACTG"] * 10)}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('service_description', response.json())
+        self.assertFalse(DNAService.objects.exists())
+
+    def test_bulk_DNA_scoring_reports_every_line(self):
+        create_super_user()
+        user = create_user()
+        token = self.get_access_token()
+        lines = [
+            json.dumps({"service_description": "[\"ACTGACTGACTG\"]", "customer_id": user.id}),
+            '{"service_description": ',
+            '',
+            json.dumps({"service_description": ["ACTGACTGACTG", "AAAAAAAAAAAA"], "customer_id": user.id}),
+            json.dumps({"service_description": ["GCGCGCATAT"], "customer_id": user.id + 100}),
+            json.dumps({"service_description": ["GCGCGCATAT"], "customer_id": user.id}),
+        ]
+        response = self.client.post(reverse('add-services-bulk'), data='\n'.join(lines),
+                                    content_type='application/x-ndjson', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        reports = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(report['line'], report['status']) for report in reports],
+                         [(1, 201), (2, 400), (4, 400), (5, 400), (6, 201)])
+        self.assertEqual(reports[2]['errors']['results'], ['valid', 'invalid'])
+        self.assertEqual(list(DNAService.objects.order_by('pk').values_list('pk', 'number')),
+                         [(reports[0]['id'], 12), (reports[4]['id'], 10)])
+
+    def test_add_DNA_scoring_with_compact_results(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        genes = ["ACTGACTGACTG", "AAAAAAAAAAAA", "ACTG", "ACTGACTGACTG", "GCGCGCATAT", "ACTGAXTGACTG"]
+        data = {"service_description": json.dumps(genes)}
+        response = self.post_response(reverse('add-service') + '?result_format=runs', data, token)
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual(results['count'], 6)
+        self.assertEqual(results['invalid'], [[1, 3], [5, 1]])
+        self.assertEqual(list(base64.b64decode(results['reasons'])),
+                         [scoring.LOW_GC, scoring.BAD_LENGTH, scoring.DUPLICATE, scoring.BAD_ALPHABET])
+        response = self.post_response(reverse('add-service') + '?result_format=bitmap', data, token)
+        self.assertEqual(base64.b64decode(response.json()['results']['invalid']), bytes([0b01110100]))
+        response = self.post_response(reverse('add-service') + '?result_format=xml', data, token)
+        self.assertIn('result_format', response.json())
+
+    def test_resubmitted_genes_are_flagged(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "[\"ACTGACTGACTG\", \"GCGCGCATAT\"]"}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.json()['repeated_genes'], 0)
+        data = {"service_description": "[\"GCGCGCATAT\", \"ATGCATGCATGC\"]"}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.json()['repeated_genes'], 1)
+        self.assertEqual(GeneFingerprint.objects.count(), 3)
+
+    def test_add_gc_profile_service(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "[\"ACTGACTGACTG\", \"GCGCGCATAT\"]", "type": "gc_profile", "window": 10}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 201)
+        response = self.get_response(reverse('view-service', args=(response.json()['id'],)), token)
+        self.assertEqual(response.json()['window'], 10)
+        self.assertEqual(response.json()['profile'], [[0.5, 0.5, 0.5], [0.6]])
+        self.assertAlmostEqual(response.json()['total_price'], 22 * 0.12)
+        response = self.get_response(reverse('view-service', args=(response.json()['id'],)) + '?result_format=runs',
+                                     token)
+        self.assertEqual(list(base64.b64decode(response.json()['profile']['profile'])), [5, 5, 5, 6])
+
+    @override_settings(DNA_SCORING_WORKERS=0)
+    def test_add_asynchronous_kmer_count_service(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"service_description": "[\"ACTGACTGACTG\", \"GCGCGCATAT\"]", "type": "kmer_count", "k": 9,
+                "asynchronous": True}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 202)
+        response = self.get_response(reverse('view-service', args=(response.json()['id'],)), token)
+        self.assertEqual(response.json()['k'], 9)
+        self.assertEqual(response.json()['kmers'], {'ACTGACTGA': 1, 'CTGACTGAC': 1, 'GACTGACTG': 1, 'TGACTGACT': 1,
+                                                    'GCGCGCATA': 1, 'CGCGCATAT': 1})
+        data = {"service_description": "[\"ACTGACTGACTG\"]", "type": "kmer_count", "k": 13}
+        response = self.post_response(reverse('add-service'), data, token)
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_DNA_scoring_from_fasta_file(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        upload = SimpleUploadedFile('genes.fasta', b'>first gene\r\nACTGAC\r\nTGACTG\r\n\n>second\nGCGCGCATAT\n')
+        response = self.client.post(reverse('add-service-fasta'), {'file': upload},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['number'], 22)
+        self.assertEqual(list(DNAService.objects.get().genes()), ["ACTGACTGACTG", "GCGCGCATAT"])
+
+    def test_add_DNA_scoring_from_invalid_fasta_file(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        upload = SimpleUploadedFile('genes.fasta', b'>first\nACTGACTGACTG\n>second\nAAAAAAAAAAAA\n')
+        response = self.client.post(reverse('add-service-fasta'), {'file': upload},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'], ['valid', 'invalid'])
+        upload = SimpleUploadedFile('genes.fasta', b'ACTGACTGACTG\n')
+        response = self.client.post(reverse('add-service-fasta'), {'file': upload},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertIn('file', response.json())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_malformed_fasta_file_spooled_to_disk_is_rejected(self):
+        create_user()
+        token = self.get_access_token(username='customer', password='1234')
+        upload = TemporaryUploadedFile('genes.fasta', 'text/plain', 0, None)
+        upload.write(b'ACTGACTGACTG\n>first\nACTGACTGACTG\n')
+        upload.flush()
+        with self.assertRaises(ValueError):
+            fasta.parse_upload(upload)
+        upload.close()
+        upload = SimpleUploadedFile('genes.fasta', b'ACTGACTGACTG\n>first\nACTGACTGACTG\n')
+        response = self.client.post(reverse('add-service-fasta'), {'file': upload},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+
+
+class OrderTests(TestCase):
+
+    def get_access_token(self, username='admin', password='123'):
+        response = self.client.post(reverse('token-obtain-pair'), {'username': username, 'password': password})
+        return response.json()['access']
+
+    def test_add_order_by_customer(self):
+        user = create_user()
+        product = Product.objects.create(product_name='primers', price=2.5)
+        token = self.get_access_token(username='customer', password='1234')
+        data = {"product_id": product.id, "customer_id": user.id, "number": 4, "status": "done"}
+        response = self.client.post(reverse('add-order'), data, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual((order.total_price, order.status, order.customer), (10.0, 'waiting', user))
+
+    def test_bulk_orders_report_every_line(self):
+        create_super_user()
+        user = create_user()
+        primers = Product.objects.create(product_name='primers', price=2.5)
+        plates = Product.objects.create(product_name='plates', price=4)
+        token = self.get_access_token()
+        lines = [
+            json.dumps({"product_id": primers.id, "customer_id": user.id, "number": 4}),
+            json.dumps({"product_id": plates.id + 100, "customer_id": user.id, "number": 1}),
+            json.dumps({"product_id": plates.id, "customer_id": user.id}),
+            json.dumps({"product_id": plates.id, "customer_id": user.id + 100, "number": 1}),
+            json.dumps({"product_id": plates.id, "customer_id": user.id, "number": 2, "total_price": 5}),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('add-orders-bulk'), data='\n'.join(lines),
+                                        content_type='application/x-ndjson', HTTP_AUTHORIZATION=f'Bearer {token}')
+            reports = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(report['line'], report['status']) for report in reports],
+                         [(1, 201), (2, 400), (3, 400), (4, 400), (5, 201)])
+        self.assertEqual([report.get('total_price') for report in reports], [10.0, None, None, None, 5])
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('pk', 'product', 'total_price')),
+                         [(reports[0]['id'], primers.id, 10.0), (reports[4]['id'], plates.id, 5)])
+        self.assertEqual(len([query for query in queries if '"dapi_product"' in query['sql']]), 1)
+
+    def test_order_list_pages_with_cursor_and_filters(self):
+        create_super_user()
+        user = create_user()
+        other = User.objects.create_user('customer2', 'customer2@example.com', '12345')
+        product = Product.objects.create(product_name='primers', price=2.5)
+        for i in range(5):
+            Order.objects.create(product=product, customer=user, number=i + 1, total_price=2.5 * (i + 1),
+                                 status='ready' if i % 2 else 'waiting')
+        Order.objects.create(product=product, customer=other, number=1, total_price=2.5)
+        token = self.get_access_token()
+        url = reverse('orders-list') + f'?customer={user.id}&page_size=2'
+        numbers = []
+        while url:
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, 200)
+            numbers += [order['number'] for order in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(numbers, [5, 4, 3, 2, 1])
+        response = self.client.get(reverse('orders-list') + '?status=ready', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual([order['number'] for order in response.json()['results']], [4, 2])
+        token = self.get_access_token(username='customer2', password='12345')
+        response = self.client.get(reverse('orders-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual([order['customer'] for order in response.json()['results']], ['customer2'])
+
+    def test_bulk_status_transition_updates_only_legal_orders(self):
+        create_super_user()
+        user = create_user()
+        product = Product.objects.create(product_name='primers', price=2.5)
+        orders = [Order.objects.create(product=product, customer=user, number=1, total_price=2.5, status=status)
+                  for status in ('waiting', 'in_production', 'in_production', 'ready')]
+        token = self.get_access_token()
+        data = {"status": "ready", "ids": [order.id for order in orders[:3]]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('orders-status'), data, content_type='application/json',
+                                        HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.json(), {"status": "ready", "updated": 2})
+        self.assertEqual([query['sql'].split()[0] for query in queries if 'dapi_order' in query['sql']],
+                         ['INSERT', 'UPDATE'])
+        # the order created as ready was queued when it was saved
+        self.assertEqual(sorted(OrderNotification.objects.values_list('order', flat=True)),
+                         [orders[1].id, orders[2].id, orders[3].id])
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('status', flat=True)),
+                         ['waiting', 'ready', 'ready', 'ready'])
+        data = {"status": "done", "filter": {"customer": user.id}}
+        response = self.client.post(reverse('orders-status'), data, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.json()['updated'], 3)
+        response = self.client.post(reverse('orders-status'), {"status": "waiting", "ids": [orders[0].id]},
+                                    content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_orders_saved_as_ready_outside_the_api_are_queued(self):
+        user = create_user()
+        product = Product.objects.create(product_name='primers', price=2.5)
+        order = Order.objects.create(product=product, customer=user, number=1, total_price=2.5)
+        Order.objects.create(product=product, customer=user, number=1, total_price=2.5, status='ready')
+        # what the admin does
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'ready'
+        order.save()
+        order.order_description = 'rush'
+        order.save()
+        self.assertEqual(OrderNotification.objects.filter(order=order).count(), 1)
+        self.assertEqual(OrderNotification.objects.count(), 2)
+
+    def test_empty_or_unknown_transition_filters_are_rejected(self):
+        user = create_user()
+        create_super_user()
+        product = Product.objects.create(product_name='primers', price=2.5)
+        Order.objects.create(product=product, customer=user, number=1, total_price=2.5)
+        token = self.get_access_token()
+        for order_filter in ({}, {"stauts": "waiting"}, {"status": "waiting", "customr": user.id}):
+            response = self.client.post(reverse('orders-status'), {"status": "in_production", "filter": order_filter},
+                                        content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('filter', response.json())
+        self.assertEqual(list(Order.objects.values_list('status', flat=True)), ['waiting'])
+
+    def test_outbox_notifies_ready_orders_in_batches(self):
+        user = create_user()
+        other = User.objects.create_user('customer2', 'customer2@example.com', '12345')
+        product = Product.objects.create(product_name='primers', price=2.5)
+        orders = [Order.objects.create(product=product, customer=customer, number=1, total_price=2.5,
+                                       status='ready') for customer in (user, other, user)]
+        Order.objects.filter(pk=orders[2].pk).update(status='waiting')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(outbox.process(batch_size=2), 2)
+            self.assertEqual(outbox.process(batch_size=2), 1)
+            self.assertEqual(outbox.process(batch_size=2), 0)
+        self.assertEqual([message.to for message in mail.outbox], [['customer@example.com'], ['customer2@example.com']])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 2)
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('status', 'notification_status')),
+                         [('done', 'sent'), ('done', 'sent'), ('waiting', '')])
+        self.assertFalse(OrderNotification.objects.exists())
+
+
+class ProductCacheTests(TestCase):
+
+    def test_cache_reads_through_and_drops_changed_products(self):
+        product = Product.objects.create(product_name='primers', price=2.5)
+        cache = ProductCache()
+        self.assertEqual(cache.get(product.pk).price, 2.5)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_many([product.pk]), {product.pk: cache.get(product.pk)})
+        get_product_cache().get(product.pk)
+        product.price = 3
+        product.save()
+        self.assertEqual(get_product_cache().get(product.pk).price, 3)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_version_bumped_by_another_process_invalidates(self):
+        product = Product.objects.create(product_name='primers', price=2.5)
+        cache = ProductCache()
+        cache.get(product.pk)
+        versions.bump_version(catalog.VERSION)
+        with self.assertNumQueries(2):
+            cache.get(product.pk)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_bump_by_another_process_is_seen_after_the_check_interval(self):
+        product = Product.objects.create(product_name='primers', price=2.5)
+        cache = ProductCache()
+        cache.get(product.pk)
+        # what a bump in another process leaves behind, nothing in this process is told
+        VersionCounter.objects.create(name=catalog.VERSION, value=100)
+        with self.assertNumQueries(0):
+            cache.get(product.pk)
+        with mock.patch('dapi.versions.time.monotonic', return_value=time.monotonic() + 2), \
+                self.assertNumQueries(2):
+            cache.get(product.pk)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+class DNAScoringEngineTests(TestCase):
+
+    genes = ["ACTGACTGACTG", "AAAAAAAAAAAA", "GGGGGGGGGGGG", "ACTG", "ACTGACTGAXTG", "ACTGACTGACTÄ",
+             "", "AT" * 2500 + "GC", "GC" * 2501, "ATATATGCAT", "ATATATGCATAT", "GCGCGCATAT", "GCAAAAAAAAAAAAGC",
+             "ACTGACTGACTG"]
+
+    def test_numpy_engine_matches_python_engine(self):
+        self.assertEqual(scoring.numpy_engine(self.genes), scoring.python_engine(self.genes))
+
+    def test_dna_scoring_engines_agree(self):
+        self.assertEqual(scoring.dna_scoring(self.genes, scoring.NUMPY_ENGINE),
+                         scoring.dna_scoring(self.genes, scoring.PYTHON_ENGINE))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            scoring.dna_scoring(self.genes, 'fortran')
+
+
+class DNAStreamingParseTests(TestCase):
+
+    def test_iter_genes_matches_json(self):
+        for text in ['[]', ' [ ] ', '["ACTG"]', '[ "ACTG" ,\n"GG\\u0041"\t]\n', '["", "A\\"C"]']:
+            self.assertEqual(list(scoring.iter_genes(text)), json.loads(text))
+
+    def test_iter_genes_rejects_malformed_input(self):
+        for text in ['', '{}', '"ACTG"', '[1]', '["ACTG"', '["ACTG",]', '["ACTG"] x', '["ACTG" "GG"]']:
+            with self.assertRaises(ValueError):
+                list(scoring.iter_genes(text))
+
+    @override_settings(DNA_SCORING_CHUNK=1)
+    def test_verdict_stops_at_first_failure(self):
+        def genes():
+            yield "ACTGACTGACTG"
+            yield "AAAAAAAAAAAA"
+            raise AssertionError("read past the first invalid gene")
+
+        self.assertEqual(scoring.dna_verdict(genes()), (False, 2, 24))
+
+    def test_duplicate_genes_are_invalid(self):
+        genes = scoring.iter_genes('["ACTGACTGACTG", "ACTGACTGACTG"]')
+        is_valid, results, number_of_proteins = scoring.dna_scoring(genes)
+        self.assertFalse(is_valid)
+        self.assertEqual(results, ['valid', 'valid'])
+        self.assertEqual(number_of_proteins, 24)
+
+
+    def test_fasta_lines_are_joined_across_chunks(self):
+        lines = [b'>first', b'ACGT' * 100000, b'GC' * 7, b'', b'>second\r', b'T' * 3, b'>empty', b'>last', b'A\r', b'C']
+        sequence, bounds = fasta.parse(b'\n'.join(lines))
+        self.assertEqual(bounds.tolist(), [0, 400014, 400017, 400017, 400019])
+        self.assertEqual(sequence[399998:400016].tobytes(), b'GT' + b'GC' * 7 + b'TT')
+        self.assertEqual(sequence[-2:].tobytes(), b'AC')
+
+    def test_fasta_parse_allocates_little_beyond_the_sequence(self):
+        data = b''.join(b'>gene %d\n' % number + b'ACGT' * 25000 + b'\n' for number in range(40))
+        tracemalloc.start()
+        try:
+            sequence, bounds = fasta.parse(data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(sequence), 4000000)
+        self.assertLess(peak, len(sequence) * 1.25)
+
+class VerdictCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_lru_hits_and_eviction(self):
+        cache = VerdictCache(2)
+        engine = scoring.get_engine()
+        self.assertEqual(cache.score(["ACTGACTGACTG", "AAAAAAAAAAAA"], engine), [scoring.VALID, scoring.LOW_GC])
+        self.assertEqual(cache.score(["ACTGACTGACTG", "GCGCGCATAT"], engine), [scoring.VALID, scoring.VALID])
+        self.assertEqual(cache.score(["AAAAAAAAAAAA"], engine), [scoring.LOW_GC])
+        self.assertEqual(cache.stats(), {'size': 2, 'max_size': 2, 'hits': 1, 'shared_hits': 0, 'misses': 4})
+
+    def test_shared_backend_is_used_across_caches(self):
+        engine = scoring.get_engine()
+        VerdictCache(10, 'default').score(["ACTGACTGACTG", "AAAAAAAAAAAA"], engine)
+        cache = VerdictCache(10, 'default')
+        self.assertEqual(cache.score(["ACTGACTGACTG", "AAAAAAAAAAAA"], scoring.python_engine),
+                         [scoring.VALID, scoring.LOW_GC])
+        self.assertEqual(cache.stats()['shared_hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_rules_change_invalidates_entries(self):
+        cache = VerdictCache(10, 'default')
+        engine = scoring.get_engine()
+        self.assertEqual(cache.score(["ACTGACTGACTG"], engine), [scoring.VALID])
+        with mock.patch.object(scoring, 'GC_HIGH', 0.5):
+            self.assertEqual(cache.score(["ACTGACTGACTG"], scoring.python_engine), [scoring.HIGH_GC])
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+
+class DNAPackingTests(TestCase):
+
+    def test_pack_round_trip(self):
+        genes = ["ACTGACTGACTG", "", "A", "GCGCGCATAT" * 301, "TTT"]
+        for compress in (True, False):
+            data = packing.pack_genes(genes, compress)
+            self.assertEqual(list(packing.iter_genes(data)), genes)
+            self.assertEqual(packing.unpack_text(data), json.dumps(genes))
+
+    @override_settings(DNA_SCORING_CHUNK=2)
+    def test_pack_across_batches(self):
+        genes = ["ACT", "G", "ACTGA", "CC", "TTTTTTT"]
+        self.assertEqual(list(packing.iter_genes(packing.pack_genes(genes))), genes)
+
+    def test_packed_is_smaller_than_text(self):
+        genes = ["ACTGACTGACTG" * 10] * 100
+        self.assertLess(len(packing.pack_genes(genes, compress=False)), len(json.dumps(genes)) / 3)
+
+    def test_unpackable_text_is_kept_raw(self):
+        for text in ['["ACTGAXTG"]', '', 'not json', '["ACTGÄ"]']:
+            data = packing.pack_text(text)
+            self.assertEqual(packing.unpack_text(data), text)
+
+    def test_service_description_is_decoded_lazily(self):
+        user = create_user()
+        service = DNAService.objects.create(customer=user, number=12, service_description='["ACTGACTGACTG"]')
+        service = DNAService.objects.get(pk=service.pk)
+        with mock.patch.object(packing, 'unpack_text', wraps=packing.unpack_text) as unpack_text:
+            self.assertEqual(service.number, 12)
+            unpack_text.assert_not_called()
+            self.assertEqual(service.service_description, '["ACTGACTGACTG"]')
+            self.assertEqual(service.service_description, '["ACTGACTGACTG"]')
+            unpack_text.assert_called_once()
+        self.assertEqual(list(service.genes()), ["ACTGACTGACTG"])
+
+
+class GeneScannerTests(TestCase):
+
+    def test_scan_metrics(self):
+        gene_scan = scoring.scan(["ACTGACTGACTG", "", "AAAAGGGCCT", "ACXGGGGX", "G"])
+        self.assertEqual(gene_scan['length'].tolist(), [12, 0, 10, 8, 1])
+        self.assertEqual(gene_scan['invalid_at'].tolist(), [-1, -1, -1, 2, -1])
+        self.assertEqual(gene_scan['gc'].tolist(), [6, 0, 5, 5, 1])
+        self.assertEqual(gene_scan['max_homopolymer'].tolist(), [1, 0, 4, 4, 1])
+        self.assertEqual(gene_scan['reason'].tolist(),
+                         [scoring.VALID, scoring.BAD_LENGTH, scoring.VALID, scoring.BAD_LENGTH, scoring.BAD_LENGTH])
+
+    def test_runs_do_not_cross_genes(self):
+        gene_scan = scoring.scan(["AAAAAAAAAAAA", "AAAAAAAAAAAA"])
+        self.assertEqual(gene_scan['max_homopolymer'].tolist(), [12, 12])
+
+    def test_report(self):
+        is_valid, report, number_of_proteins = scoring.dna_report(
+            ["ACTGACTGACTG", "ACTGACXGACTG", "ACTGACTGACTG"])
+        self.assertFalse(is_valid)
+        self.assertEqual(number_of_proteins, 36)
+        self.assertEqual([gene['reason'] for gene in report], ['valid', 'alphabet', 'duplicate'])
+        self.assertEqual(report[1], {'reason': 'alphabet', 'length': 12, 'invalid_at': 6, 'gc_ratio': 0.5,
+                                     'max_homopolymer': 1})
+
+
+class ParallelScoringTests(TestCase):
+
+    genes = ["ACTGACTGACTG", "AAAAAAAAAAAA", "", "GCGCGCATAT" * 30, "ACTGACTGACTG", "ACXGACTGACTG"] * 20
+
+    @override_settings(DNA_SCORING_WORKERS=2)
+    def test_parallel_reasons_match_serial_scoring(self):
+        progress = []
+        self.assertEqual(jobs.parallel_reasons(iter(self.genes), progress.append), scoring.dna_reasons(self.genes))
+        self.assertEqual(progress[-1], len(self.genes))
+
+    def test_split_genes_balances_bases(self):
+        bounds = np.array([0, 10, 20, 120, 130, 140])
+        self.assertEqual(jobs.split_genes(bounds, 2), [0, 3, 5])
+        self.assertEqual(jobs.split_genes(np.zeros(4, dtype=np.int64), 3), [0, 3])
+
+    @override_settings(DNA_SCORING_WORKERS=2, DNA_SCORING_PARALLEL_THRESHOLD=100)
+    def test_threshold(self):
+        self.assertTrue(jobs.should_run_parallel(100))
+        self.assertFalse(jobs.should_run_parallel(99))
+        with self.settings(DNA_SCORING_WORKERS=0):
+            self.assertFalse(jobs.should_run_parallel(100))
+
+
+@override_settings(DNA_SCORING_WORKERS=0, DNA_JOB_TIMEOUT=600, DNA_JOB_MAX_ATTEMPTS=3)
+class ScoringJobRecoveryTests(TestCase):
+
+    def create_service(self, status, age, attempt=0):
+        service = DNAService.objects.create(customer=create_user(), number=24, gene_count=2, status=status,
+                                            service_description='["ACTGACTGACTG", "AAAAAAAAAAAA"]',
+                                            job_attempt=attempt)
+        DNAService.objects.filter(pk=service.pk).update(job_updated_at=timezone.now() - timedelta(seconds=age))
+        return service
+
+    def test_lost_job_is_submitted_again(self):
+        service = self.create_service(OrderStatus.IN_PRODUCTION, 3600)
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        service.refresh_from_db()
+        self.assertEqual(service.status, OrderStatus.READY)
+        self.assertEqual(service.job_attempt, 1)
+        self.assertFalse(service.is_valid)
+        self.assertEqual(service.scored_genes, 2)
+        self.assertEqual(service.job_error, '')
+
+    def test_jobs_still_making_progress_are_left_alone(self):
+        service = self.create_service(OrderStatus.WAITING, 60)
+        self.assertEqual(jobs.recover_stale_jobs(), 0)
+        service.refresh_from_db()
+        self.assertEqual((service.status, service.job_attempt), (OrderStatus.WAITING, 0))
+
+    def test_job_lost_too_often_is_reported_as_failed(self):
+        service = self.create_service(OrderStatus.IN_PRODUCTION, 3600, attempt=2)
+        self.assertEqual(jobs.recover_stale_jobs(), 0)
+        service.refresh_from_db()
+        self.assertEqual(service.status, OrderStatus.READY)
+        self.assertIsNone(service.is_valid)
+        self.assertEqual(service.job_error, 'scoring job was lost 3 times')
+
+    def test_failed_job_is_not_reported_as_invalid_dna(self):
+        service = self.create_service(OrderStatus.WAITING, 0)
+
+        def scorer(batches, engine):
+            raise RuntimeError('worker crashed')
+
+        jobs.run_attempt(service.pk, 0, scorer)
+        service.refresh_from_db()
+        self.assertEqual(service.status, OrderStatus.READY)
+        self.assertIsNone(service.is_valid)
+        self.assertIn('worker crashed', service.job_error)
+
+    def test_attempt_taken_over_does_not_run(self):
+        service = self.create_service(OrderStatus.WAITING, 0, attempt=1)
+        jobs.run_scoring_job(service.pk, attempt=0)
+        service.refresh_from_db()
+        self.assertEqual((service.status, service.scored_genes), (OrderStatus.WAITING, 0))
+        self.assertFalse(GeneFingerprint.objects.exists())
+
+    def test_resubmitted_job_does_not_count_its_own_genes_as_repeated(self):
+        service = self.create_service(OrderStatus.IN_PRODUCTION, 3600)
+        get_gene_index().record(service)
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        service.refresh_from_db()
+        self.assertEqual(service.repeated_genes, 0)
+
+
+class GeneIndexTests(TestCase):
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1 << 12, 3)
+        fingerprints = [scoring.fingerprint(str(i)) for i in range(300)]
+        bloom.add(fingerprints[:150])
+        self.assertTrue(bloom.might_contain(fingerprints[:150]).all())
+        self.assertLess(bloom.might_contain(fingerprints[150:]).sum(), 15)
+
+    def test_index_sees_fingerprints_stored_by_other_processes(self):
+        user = create_user()
+        service = DNAService.objects.create(customer=user, number=12, service_description='["ACTGACTGACTG"]')
+        index = GeneIndex(1 << 12, 3)
+        self.assertEqual(index.record(service), 0)
+        other = GeneIndex(1 << 12, 3)
+        known = other.known([scoring.fingerprint("ACTGACTGACTG"), scoring.fingerprint("GCGCGCATAT")])
+        self.assertEqual(known.tolist(), [True, False])
+        self.assertEqual(other.stats()['loaded_upto'], GeneFingerprint.objects.get().pk)
+
+    @override_settings(GENE_INDEX_SYNC_INTERVAL=60)
+    def test_rows_committed_out_of_order_are_loaded_and_syncs_are_throttled(self):
+        user = create_user()
+        service = DNAService.objects.create(customer=user, number=12, service_description='["ACTGACTGACTG"]')
+        GeneFingerprint.objects.create(pk=10, fingerprint=1, service=service)
+        index = GeneIndex(1 << 12, 3)
+        index.sync()
+        # a transaction that took pk 9 before pk 10 was committed commits after the sync
+        GeneFingerprint.objects.create(pk=9, fingerprint=2, service=service)
+        with self.assertNumQueries(0):
+            index.sync()
+        index.sync(force=True)
+        self.assertTrue(index.bloom.might_contain([2]).all())
+        self.assertEqual(index.stats()['syncs'], 2)
+
+
+class GCProfileTests(TestCase):
+
+    def test_profile_matches_windows_counted_per_gene(self):
+        rng = np.random.default_rng(3)
+        genes = [''.join(rng.choice(list('ACGT'), size=size)) for size in (0, 5, 12, 40, 300)]
+        for window in (1, 12, 255, 256):
+            expected = [[(gene[i:i + window].count('G') + gene[i:i + window].count('C')) / window
+                         for i in range(len(gene) - window + 1)] for gene in genes]
+            profile = profiles.ratios(profiles.gc_profile(genes, window))
+            self.assertEqual(len(profile), len(genes))
+            for got, want in zip(profile, expected):
+                np.testing.assert_allclose(got, want, atol=1e-3)
+
+
+class KmerCountTests(TestCase):
+
+    def test_dense_and_sparse_counts_match_substring_counts(self):
+        rng = np.random.default_rng(5)
+        genes = [''.join(rng.choice(list('ACGT'), size=size)) for size in (0, 3, 12, 60, 900)]
+        for k in (1, 4, kmers.DENSE_K, kmers.DENSE_K + 1, kmers.MAX_K):
+            expected = {}
+            for gene in genes:
+                for i in range(len(gene) - k + 1):
+                    expected[gene[i:i + k]] = expected.get(gene[i:i + k], 0) + 1
+            with override_settings(DNA_SCORING_CHUNK=2):
+                self.assertEqual(kmers.counts_dict(kmers.count_kmers(genes, k)), expected)
+
+    def test_merge_adds_known_codes_and_inserts_new_ones(self):
+        codes, counts = kmers.merge_counts(np.array([3, 7, 9], dtype=np.uint32), np.array([1, 2, 3]),
+                                           np.array([0, 7, 8, 12], dtype=np.uint32), np.array([5, 1, 4, 6]))
+        self.assertEqual(codes.tolist(), [0, 3, 7, 8, 9, 12])
+        self.assertEqual(counts.tolist(), [5, 1, 3, 4, 3, 6])
+
+
+class SchedulerTests(TestCase):
+
+    def test_only_one_process_holds_the_leader_lock(self):
+        path = os.path.join(tempfile.mkdtemp(), 'scheduler.lock')
+        leader, follower = LeaderLock(path), LeaderLock(path)
+        self.assertTrue(leader.acquire())
+        self.assertFalse(follower.acquire())
+        leader.release()
+        self.assertTrue(follower.acquire())
+        self.assertTrue(follower.held)
+        follower.release()
+
+    def test_scheduler_starts_in_server_processes_only(self):
+        self.assertTrue(periodic_tasks.is_server_process(['manage.py', 'runserver']))
+        self.assertTrue(periodic_tasks.is_server_process(['/usr/local/bin/gunicorn', 'genessite.wsgi']))
+        self.assertFalse(periodic_tasks.is_server_process(['manage.py', 'migrate']))
+        self.assertFalse(periodic_tasks.is_server_process(['manage.py', 'test', 'dapi']))
+        with override_settings(SCHEDULER_ENABLED=None):
+            self.assertFalse(periodic_tasks.should_schedule())
+        with override_settings(SCHEDULER_ENABLED=True):
+            self.assertTrue(periodic_tasks.should_schedule())
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    # just enough SMTP for smtplib, DATA replies are taken from `replies` before falling back to 250
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.replies = []
+        self.refused = set()
+        self.sockets = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def drop_connections(self):
+        # what a server does to connections that stayed idle for too long
+        with self.lock:
+            for sock in self.sockets:
+                sock.shutdown(socket.SHUT_RDWR)
+            self.sockets = []
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.sockets.append(self.connection)
+        self.reply('220 stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line:
+                return
+            if command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 stand-in')
+            elif command == 'RCPT':
+                recipient = line.split(':', 1)[1].strip('<> ')
+                if recipient in self.server.refused:
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 ok')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                with self.server.lock:
+                    reply = self.server.replies.pop(0) if self.server.replies else '250 queued'
+                    if reply.startswith('250'):
+                        self.server.messages.append(recipients)
+                recipients = []
+                self.reply(reply)
+            else:
+                if command in ('RSET', 'MAIL'):
+                    recipients = []
+                self.reply('250 ok')
+
+
+class EmailDeliveryTests(TestCase):
+
+    def setUp(self):
+        self.smtp = SMTPStandIn()
+        delivery.close_connections()
+        self.settings = override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                          EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.smtp.server_address[1],
+                                          EMAIL_DELIVERY_BATCH=3)
+        self.settings.enable()
+
+    def tearDown(self):
+        delivery.close_connections()
+        self.settings.disable()
+        self.smtp.stop()
+
+    def test_batches_reuse_connections_and_retry(self):
+        messages = [mail.EmailMessage('ready', 'ready', to=['customer%d@example.com' % i]) for i in range(7)]
+        self.smtp.replies = ['451 try again later']
+        self.smtp.refused = {'customer5@example.com'}
+        with self.assertLogs('dapi.delivery', 'WARNING'):
+            results = delivery.deliver(messages)
+        self.assertEqual([status for status, attempts, error in results], ['sent'] * 5 + ['failed', 'sent'])
+        self.assertEqual(sum(attempts for status, attempts, error in results), 8)
+        self.assertEqual(sorted(recipients[0] for recipients in self.smtp.messages),
+                         sorted('customer%d@example.com' % i for i in range(7) if i != 5))
+        # at most one connection per batch, plus the one opened again after the temporary failure
+        self.assertLessEqual(self.smtp.connections, 4)
+
+    def test_unreachable_server_fails_the_batch_at_once(self):
+        messages = [mail.EmailMessage('ready', 'ready', to=['customer%d@example.com' % i]) for i in range(3)]
+        self.smtp.stop()
+        started = time.monotonic()
+        with self.assertLogs('dapi.delivery', 'WARNING') as logs:
+            results = delivery.deliver(messages)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([(status, attempts) for status, attempts, error in results], [('failed', 1)] * 3)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_dropped_pooled_connection_does_not_cost_an_attempt(self):
+        delivery.deliver([mail.EmailMessage('ready', 'ready', to=['customer@example.com'])])
+        self.smtp.drop_connections()
+        results = delivery.deliver([mail.EmailMessage('ready', 'ready', to=['customer@example.com'])])
+        self.assertEqual(results, [('sent', 1, '')])
+        self.assertEqual(self.smtp.connections, 2)
+
+    def test_unexpected_errors_are_recorded_per_message(self):
+        class Broken(mail.EmailMessage):
+            def message(self):
+                raise RuntimeError('template exploded')
+
+        messages = [mail.EmailMessage('ready', 'ready', to=['first@example.com']),
+                    Broken('ready', 'ready', to=['second@example.com']),
+                    mail.EmailMessage('ready', 'ready', to=['third@example.com'])]
+        with self.assertLogs('dapi.delivery', 'ERROR'):
+            results = delivery.deliver(messages)
+        self.assertEqual(results, [('sent', 1, ''), ('failed', 1, 'template exploded'), ('sent', 1, '')])
+
+    def test_ready_orders_record_delivery_status(self):
+        user = create_user()
+        other = User.objects.create_user('customer2', 'customer2@example.com', '12345')
+        product = Product.objects.create(product_name='primers', price=2.5)
+        orders = [Order.objects.create(product=product, customer=customer, number=1, total_price=2.5,
+                                       status='ready') for customer in (user, other)]
+        self.smtp.refused = {'customer2@example.com'}
+        with self.assertLogs('dapi.delivery', 'WARNING'):
+            outbox.process()
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('status', 'notification_status',
+                                                                       'notification_attempts')),
+                         [('done', 'sent', 1), ('ready', 'failed', 1)])
+        self.assertIsNotNone(Order.objects.get(pk=orders[0].pk).notified_at)
+        # the failed email stays queued, unclaimed, until its retry is due
+        notification = OrderNotification.objects.get()
+        self.assertEqual((notification.order_id, notification.claimed_by), (orders[1].pk, ''))
+        self.assertEqual(outbox.process(), 0)
+        OrderNotification.objects.update(available_at=timezone.now())
+        with override_settings(ORDER_NOTIFICATION_MAX_ATTEMPTS=2), self.assertLogs('dapi', 'WARNING') as logs:
+            self.assertEqual(outbox.process(), 1)
+        self.assertIn('giving up', logs.output[-1])
+        self.assertEqual(Order.objects.get(pk=orders[1].pk).notification_attempts, 2)
+        self.assertFalse(OrderNotification.objects.exists())
+
+
+@override_settings(ORDER_EVENTS_POLL_INTERVAL=0.05)
+class OrderEventsTests(TestCase):
+
+    def make_orders(self):
+        user = create_user()
+        other = User.objects.create_user('customer2', 'customer2@example.com', '12345')
+        product = Product.objects.create(product_name='primers', price=2.5)
+        orders = [Order.objects.create(product=product, customer=customer, number=1, total_price=2.5)
+                  for customer in (user, other)]
+        return orders, str(RefreshToken.for_user(user).access_token)
+
+    @staticmethod
+    def move_orders(orders):
+        for order in Order.objects.filter(pk__in=[order.pk for order in orders]):
+            order.status = 'in_production'
+            order.save()
+
+    def scope(self, query_string):
+        return {'type': 'http', 'method': 'GET', 'path': '/orders/events/', 'query_string': query_string,
+                'headers': []}
+
+    async def test_stream_sends_status_changes_of_own_orders(self):
+        orders, token = await sync_to_async(self.make_orders)()
+        communicator = ApplicationCommunicator(application, self.scope(f'token={token}'.encode()))
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(5)
+        self.assertEqual((start['status'], dict(start['headers'])[b'content-type']), (200, b'text/event-stream'))
+        self.assertEqual((await communicator.receive_output(5))['body'], b': connected\n\n')
+        await sync_to_async(self.move_orders)(orders)
+        body = (await communicator.receive_output(5))['body'].decode()
+        self.assertTrue(body.startswith('event: order\ndata: '))
+        event = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual((event['id'], event['status']), (orders[0].pk, 'in_production'))
+        await sync_to_async(self.move_orders)(orders)
+        self.assertTrue(await communicator.receive_nothing(0.3))
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+        self.assertEqual(get_hub().subscribers, {})
+
+    async def test_stream_requires_a_valid_token(self):
+        communicator = ApplicationCommunicator(application, self.scope(b'token=nonsense'))
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        self.assertEqual((await communicator.receive_output(5))['status'], 401)
+
+
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        get_user_cache().clear()
+
+    def get(self, url, token):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_repeated_requests_make_no_auth_queries(self):
+        create_super_user()
+        token = str(RefreshToken.for_user(User.objects.get(username='admin')).access_token)
+        self.assertEqual(self.get(reverse('verdict-cache-stats'), token).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(reverse('verdict-cache-stats'), token).status_code, 200)
+
+    def test_cached_user_is_dropped_when_user_or_groups_change(self):
+        make_groups()
+        user = create_user()
+        token = str(RefreshToken.for_user(user).access_token)
+        data = {"username": "c2", "password": "Strong-pass-42", "password2": "Strong-pass-42",
+                "email": "c2@example.com", "first_name": "c", "last_name": "two", "group": "customer"}
+        response = self.client.post(reverse('user-register'), data, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 400)
+        Group.objects.get(name='orgs').user_set.add(user)
+        response = self.client.post(reverse('user-register'), data, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 201)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get(reverse('view-user', args=(user.id,)), token).status_code, 401)
+
+    def test_deactivation_in_another_process_is_seen(self):
+        user = create_user()
+        token = str(RefreshToken.for_user(user).access_token)
+        self.assertEqual(self.get(reverse('view-user', args=(user.id,)), token).status_code, 200)
+        # what a deactivation through ActiveUserView leaves behind when it runs in another worker:
+        # the row and the shared counter change, nothing in this process is told
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        VersionCounter.objects.filter(name=user_version(user.pk)).update(value=F('value') + 1)
+        # once the versions this process read are VERSION_CHECK_INTERVAL seconds old
+        with mock.patch('dapi.versions.time.monotonic', return_value=time.monotonic() + 2):
+            self.assertEqual(self.get(reverse('view-user', args=(user.id,)), token).status_code, 401)
+
+
+class PasswordHashingTests(TestCase):
+
+    def test_logins_are_checked_on_the_pool_and_old_hashes_upgraded(self):
+        user = create_user()
+        user.password = PBKDF2PasswordHasher().encode('1234', 'somesalt', iterations=1000)
+        user.save()
+        service = HashingService(1, 1, 5)
+        try:
+            with mock.patch('dapi.hashing._service', service):
+                response = self.client.post(reverse('token-obtain-pair'), {'username': 'customer', 'password': '1234'})
+                self.assertEqual(response.status_code, 200)
+                response = self.client.post(reverse('token-obtain-pair'), {'username': 'customer', 'password': '4321'})
+                self.assertEqual(response.status_code, 401)
+        finally:
+            service.get_pool().shutdown()
+        user.refresh_from_db()
+        self.assertNotIn('$1000$', user.password)
+        self.assertTrue(user.check_password('1234'))
+        # two checks, the upgrade and no rejections
+        self.assertEqual(service.stats()['completed'], 3)
+        self.assertEqual(service.stats()['rejected'], 0)
+
+    def test_full_service_rejects_after_timeout(self):
+        service = HashingService(1, 0, 0.05)
+        busy = threading.Thread(target=service.run, args=(time.sleep, 1))
+        busy.start()
+        try:
+            while not service.stats()['in_flight']:
+                time.sleep(0.01)
+            with self.assertRaises(HashingBusy):
+                service.run(time.sleep, 0)
+            self.assertEqual(service.stats()['rejected'], 1)
+            self.assertEqual(service.stats()['max_waiting'], 1)
+        finally:
+            busy.join()
+            service.get_pool().shutdown()
+
+
+class BulkUserImportTests(TestCase):
+
+    def post(self, data, content_type, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        response = self.client.post(reverse('user-register-bulk'), data=data, content_type=content_type,
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def row(self, username, email, group='customer', password='Strong-pass-42'):
+        return {"username": username, "email": email, "password": password, "password2": password,
+                "first_name": "new", "last_name": "user", "group": group}
+
+    def test_org_imports_customers_from_ndjson(self):
+        make_groups()
+        org = create_user()
+        Group.objects.get(name='orgs').user_set.add(org)
+        lines = [json.dumps(self.row('c1', 'c1@example.com')),
+                 json.dumps(self.row('c2', 'customer@example.com')),
+                 json.dumps(self.row('c1', 'other@example.com')),
+                 json.dumps(self.row('s1', 's1@example.com', group='staff')),
+                 '{"username": ',
+                 json.dumps(self.row('c3', 'c3@example.com'))]
+        reports = self.post('\n'.join(lines), 'application/x-ndjson', org)
+        self.assertEqual([(report['line'], report['status']) for report in reports],
+                         [(1, 201), (2, 400), (3, 400), (4, 400), (5, 400), (6, 201)])
+        self.assertIn('email', reports[1]['errors'])
+        self.assertIn('username', reports[2]['errors'])
+        self.assertIn('user', reports[3]['errors'])
+        self.assertEqual(list(User.objects.filter(groups__name='customer').order_by('pk').values_list('pk', flat=True)),
+                         [reports[0]['id'], reports[5]['id']])
+        response = self.client.post(reverse('token-obtain-pair'), {'username': 'c3', 'password': 'Strong-pass-42'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_csv_import_query_count_does_not_grow_with_rows(self):
+        make_groups()
+        admin = create_super_user()
+        header = 'username,email,password,password2,first_name,last_name,group\n'
+        rows = ''.join('u%d,u%d@example.com,Strong-pass-42,Strong-pass-42,new,user,%s\n'
+                       % (i, i, 'staff' if i == 0 else 'customer') for i in range(20))
+        with CaptureQueriesContext(connection) as queries:
+            reports = self.post(header + rows, 'text/csv', admin)
+        self.assertEqual({report['status'] for report in reports}, {201})
+        self.assertEqual(reports[0]['line'], 2)
+        # the user version, the user and its groups, all groups, the uniqueness check, savepoint, users,
+        # memberships, release
+        self.assertLessEqual(len(queries), 9)
+        self.assertTrue(User.objects.get(username='u0').is_superuser)
+        self.assertEqual(User.groups.through.objects.filter(user__username__startswith='u').count(), 20)
+
+
+class UsersListTests(TestCase):
+
+    def setUp(self):
+        make_groups()
+        self.token = str(RefreshToken.for_user(create_super_user()).access_token)
+        customers = Group.objects.get(name='customer')
+        for i in range(6):
+            customers.user_set.add(User.objects.create_user('u%d' % i, 'u%d@example.com' % i, 'pass'))
+
+    def get(self, url):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_pages_make_the_same_queries_whatever_their_size(self):
+        self.get(reverse('users_list'))
+        with CaptureQueriesContext(connection) as small:
+            response = self.get(reverse('users_list') + '?page_size=2')
+        self.assertEqual([user['username'] for user in response.data['results']], ['u5', 'u4'])
+        with CaptureQueriesContext(connection) as large:
+            response = self.get(response.data['next'].replace('page_size=2', 'page_size=10'))
+        self.assertEqual([user['username'] for user in response.data['results']], ['u3', 'u2', 'u1', 'u0', 'admin'])
+        self.assertEqual(response.data['results'][0]['groups'], [Group.objects.get(name='customer').pk])
+        self.assertEqual(len(small), len(large))
+
+    @override_settings(USERS_LIST_CHUNK_SIZE=3)
+    def test_streamed_list_reads_users_in_chunks(self):
+        self.get(reverse('users_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(reverse('users_list') + '?format=stream')
+            users = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual([user['username'] for user in users], ['u5', 'u4', 'u3', 'u2', 'u1', 'u0', 'admin'])
+        self.assertEqual(users[-1]['groups'], [])
+        # one query read in chunks of three, and the groups of each chunk
+        self.assertEqual(len(queries), 4)
@@ -1,20 +1,32 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import RegisterView, UpdateUserView, ChangePasswordView, ActiveUserView, CreateProductView,\
-    UpdateProductView, CreateOrderView, UpdateOrderView, CreateDNAScopingServiceView, UsersListView, UserView
+from .views import RegisterView, BulkUserView, UpdateUserView, ChangePasswordView, ActiveUserView, CreateProductView,\
+    UpdateProductView, ProductCacheStatsView, CreateOrderView, OrderListView, BulkOrderView, UpdateOrderView, \
+    OrderTransitionView, CreateDNAScopingServiceView, DNAServiceView, BulkDNAScoringServiceView, \
+    FastaDNAScoringServiceView, VerdictCacheStatsView, HashingStatsView, UsersListView, UserView
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token-obtain-pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('register/', RegisterView.as_view(), name='user-register'),
+    path('register/bulk/', BulkUserView.as_view(), name='user-register-bulk'),
     path('update_profile/<int:pk>/', UpdateUserView.as_view(), name='update-profile'),
     path('change_password/<int:pk>/', ChangePasswordView.as_view(), name='change-password'),
     path('activate/<int:pk>/', ActiveUserView.as_view(), name='activate-user'),
     path('products/', CreateProductView.as_view(), name='add-product'),
     path('products/<int:pk>/', UpdateProductView.as_view(), name='update-product'),
+    path('products/cache/', ProductCacheStatsView.as_view(), name='product-cache-stats'),
     path('orders/', CreateOrderView.as_view(), name='add-order'),
+    path('orders/list/', OrderListView.as_view(), name='orders-list'),
+    path('orders/status/', OrderTransitionView.as_view(), name='orders-status'),
     path('orders/<int:pk>/', UpdateOrderView.as_view(), name='update-order'),
+    path('orders/bulk/', BulkOrderView.as_view(), name='add-orders-bulk'),
     path('services/', CreateDNAScopingServiceView.as_view(), name='add-service'),
+    path('services/<int:pk>/', DNAServiceView.as_view(), name='view-service'),
+    path('services/bulk/', BulkDNAScoringServiceView.as_view(), name='add-services-bulk'),
+    path('services/fasta/', FastaDNAScoringServiceView.as_view(), name='add-service-fasta'),
+    path('services/cache/', VerdictCacheStatsView.as_view(), name='verdict-cache-stats'),
     path('users/', UsersListView.as_view(), name='users_list'),
+    path('users/hashing/', HashingStatsView.as_view(), name='password-hashing-stats'),
     path('users/<int:pk>/', UserView.as_view(), name='view-user'),
 ]
@@ -0,0 +1,134 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import scoring
+
+
+def rules_token():
+    rules = (scoring.RULES_VERSION, scoring.MIN_GENE_LENGTH, scoring.MAX_GENE_LENGTH, scoring.GC_LOW, scoring.GC_HIGH)
+    return hashlib.blake2b(repr(rules).encode(), digest_size=8).hexdigest()
+
+
+class VerdictCache:
+
+    def __init__(self, size, backend=None, timeout=None):
+        self.size = size
+        self.backend = caches[backend] if backend else None
+        self.timeout = timeout
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._rules = rules_token()
+
+    def _check_rules(self):
+        # entries scored under other rules are dropped, shared keys carry the token so they just stop matching
+        rules = rules_token()
+        if rules != self._rules:
+            self._entries.clear()
+            self._rules = rules
+        return rules
+
+    def _shared_key(self, rules, key):
+        return 'dna-verdict:%s:%d' % (rules, key)
+
+    def lookup(self, genes):
+        keys = [scoring.fingerprint(gene) for gene in genes]
+        verdicts = [None] * len(keys)
+        missing = []
+        with self._lock:
+            rules = self._check_rules()
+            for i, key in enumerate(keys):
+                verdict = self._entries.get(key)
+                if verdict is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    verdicts[i] = verdict
+            self.hits += len(keys) - len(missing)
+
+        if missing and self.backend is not None:
+            shared = self.backend.get_many([self._shared_key(rules, keys[i]) for i in missing])
+            if shared:
+                still_missing = []
+                found = {}
+                for i in missing:
+                    verdict = shared.get(self._shared_key(rules, keys[i]))
+                    if verdict is None:
+                        still_missing.append(i)
+                    else:
+                        verdicts[i] = verdict
+                        found[keys[i]] = verdict
+                self._remember(rules, found)
+                with self._lock:
+                    self.shared_hits += len(found)
+                missing = still_missing
+
+        with self._lock:
+            self.misses += len(missing)
+        return verdicts, keys
+
+    def fill(self, verdicts, keys, scored):
+        # puts the freshly scored verdicts into the holes left by lookup
+        scored = iter(scored)
+        found = {}
+        for i, verdict in enumerate(verdicts):
+            if verdict is None:
+                verdicts[i] = found[keys[i]] = next(scored)
+        with self._lock:
+            rules = self._check_rules()
+        self._remember(rules, found)
+        if found and self.backend is not None:
+            self.backend.set_many({self._shared_key(rules, key): verdict for key, verdict in found.items()},
+                                  timeout=self.timeout)
+        return verdicts
+
+    def _remember(self, rules, found):
+        with self._lock:
+            if rules != self._rules:
+                return
+            for key, verdict in found.items():
+                self._entries[key] = verdict
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def score(self, genes, engine):
+        verdicts, keys = self.lookup(genes)
+        missing = [gene for gene, verdict in zip(genes, verdicts) if verdict is None]
+        return self.fill(verdicts, keys, engine(missing) if missing else [])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_verdict_cache():
+    global _cache
+    size = getattr(settings, 'DNA_VERDICT_CACHE_SIZE', 0)
+    if not size:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = VerdictCache(size, getattr(settings, 'DNA_VERDICT_CACHE_BACKEND', None),
+                                  getattr(settings, 'DNA_VERDICT_CACHE_TIMEOUT', None))
+        return _cache
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import VersionCounter
+
+_lock = threading.Lock()
+# name -> (value, time it was read) of the counters this process read
+_known = {}
+# changes on every bump here, a read that overlapped a bump does not keep what it read
+_generation = 0
+# entries kept before the ones too old to be used are dropped
+MAX_KNOWN = 100000
+
+
+def current_version(name, max_age=0):
+    return current_versions([name], max_age)[0]
+
+
+def current_versions(names, max_age=0):
+    # counters this process read less than max_age seconds ago are not read again, changes made by other
+    # processes are then seen up to max_age seconds late, bumps made by this process right away.
+    # the others are read with a single query, a counter that was never bumped reads as 0
+    now = time.monotonic()
+    with _lock:
+        known = {name: _known.get(name) for name in names}
+        generation = _generation
+    stale = [name for name, entry in known.items() if entry is None or now - entry[1] >= max_age]
+    if stale:
+        found = dict(VersionCounter.objects.filter(name__in=stale).values_list('name', 'value'))
+        with _lock:
+            for name in stale:
+                known[name] = (found.get(name, 0), now)
+            if max_age and generation == _generation:
+                if len(_known) >= MAX_KNOWN:
+                    for name, (value, read_at) in list(_known.items()):
+                        if now - read_at >= max_age:
+                            del _known[name]
+                _known.update((name, known[name]) for name in stale)
+    return tuple(known[name][0] for name in names)
+
+
+def bump_version(name):
+    # every process holding data tagged with an older version drops it on its next read,
+    # the increment happens in the database so concurrent bumps are never lost
+    global _generation
+    if not VersionCounter.objects.filter(name=name).update(value=F('value') + 1):
+        try:
+            with transaction.atomic():
+                VersionCounter.objects.create(name=name, value=1)
+        except IntegrityError:
+            VersionCounter.objects.filter(name=name).update(value=F('value') + 1)
+    with _lock:
+        _generation += 1
+        _known.pop(name, None)
@@ -1,12 +1,32 @@
-from rest_framework import generics
-from django.contrib.auth.models import User
+import json
 
-from .serializers import RegisterSerializer, UpdateUserSerializer, ChangePasswordSerializer,\
-    ActivateUserSerializer, CreateUpdateProductSerializer, CreateOrderSerializer, UpdateOrderSerializer, \
-    CreateDNAScoringServiceSerializer, UserDetailSerializer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from django.contrib.auth.models import User, Group
+
+from .serializers import RegisterSerializer, BulkUserSerializer, UpdateUserSerializer, ChangePasswordSerializer,\
+    ActivateUserSerializer, CreateUpdateProductSerializer, CreateOrderSerializer, BulkOrderSerializer, \
+    OrderSerializer, OrderTransitionSerializer, UpdateOrderSerializer, CreateDNAScoringServiceSerializer, \
+    FastaDNAScoringServiceSerializer, DNAServiceStatusSerializer, UserDetailSerializer
 from .models import Product, Order, DNAService
 from rest_framework.permissions import IsAuthenticated
-from .permissions import IsSuperUser, IsSuperUserOrOwner
+from .permissions import IsSuperUser, IsSuperUserOrOwner, IsSuperUserOrCustomer
+from .filters import OrderFilter
+from .pagination import IdCursorPagination
+from .parsers import NDJSONParser, CSVParser
+from .renderers import StreamingJSONRenderer
+from .gene_index import get_gene_index
+from .catalog import get_product_cache
+from .verdict_cache import get_verdict_cache
+from . import jobs, outbox, hashing
 # Create your views here.
 
 
@@ -16,6 +36,74 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
 
 
+class BulkUserView(generics.GenericAPIView):
+    queryset = User.objects.all()
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkUserSerializer
+    parser_classes = [NDJSONParser, CSVParser]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['groups'] = Group.objects.in_bulk(field_name='name')
+        return context
+
+    def post(self, request, *args, **kwargs):
+        context = self.get_serializer_context()
+        reports = []
+        accepted = []
+        for number, row in request.data:
+            if isinstance(row, str):
+                try:
+                    row = json.loads(row)
+                except ValueError:
+                    reports.append({"line": number, "status": 400, "errors": {"line": "invalid JSON"}})
+                    continue
+            serializer = self.get_serializer_class()(data=row, context=context)
+            if not serializer.is_valid():
+                reports.append({"line": number, "status": 400, "errors": serializer.errors})
+                continue
+            report = {"line": number}
+            reports.append(report)
+            accepted.append((report, serializer.validated_data))
+
+        # usernames and emails already taken, or repeated within the import, are found with a single query
+        taken = User.objects.filter(Q(username__in={validated_data['username'] for _, validated_data in accepted}) |
+                                    Q(email__in={validated_data['email'] for _, validated_data in accepted})) \
+            .values_list('username', 'email')
+        usernames = {username for username, _ in taken}
+        emails = {email for _, email in taken}
+        rows = []
+        for report, validated_data in accepted:
+            if validated_data['username'] in usernames:
+                report.update({"status": 400, "errors": {"username": "A user with that username already exists."}})
+            elif validated_data['email'] in emails:
+                report.update({"status": 400, "errors": {"email": "This field must be unique."}})
+            else:
+                usernames.add(validated_data['username'])
+                emails.add(validated_data['email'])
+                rows.append((report, validated_data))
+
+        passwords = hashing.make_passwords([validated_data['password'] for _, validated_data in rows])
+        users = [BulkUserSerializer.build_user(validated_data, password)
+                 for (_, validated_data), password in zip(rows, passwords)]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                User.groups.through.objects.bulk_create([
+                    User.groups.through(user_id=user.pk, group_id=context['groups'][validated_data['group']].pk)
+                    for user, (_, validated_data) in zip(users, rows)])
+        except IntegrityError:
+            # a username registered while the import ran, nothing of it was created
+            for report, _ in rows:
+                report.update({"status": 409, "errors": {"username": "usernames changed during the import, retry"}})
+        else:
+            for user, (report, _) in zip(users, rows):
+                report.update({"status": 201, "id": user.pk, "username": user.username})
+
+        return StreamingHttpResponse((json.dumps(report) + '\n' for report in reports),
+                                     content_type='application/x-ndjson')
+
+
 class UpdateUserView(generics.UpdateAPIView):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
@@ -52,6 +140,94 @@ class CreateOrderView(generics.CreateAPIView):
     serializer_class = CreateOrderSerializer
 
 
+class OrderListView(generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+    pagination_class = IdCursorPagination
+    filterset_class = OrderFilter
+
+    def get_queryset(self):
+        queryset = Order.objects.select_related('product', 'customer')
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(customer=self.request.user)
+        return queryset
+
+
+class OrderTransitionView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def post(self, request):
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"status": serializer.validated_data['status'], "updated": serializer.apply()})
+
+
+class BulkOrderView(generics.GenericAPIView):
+    queryset = Order.objects.all()
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkOrderSerializer
+    parser_classes = [NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        reports = []
+        accepted = []
+        for number, line in request.data:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                reports.append({"line": number, "status": 400, "errors": {"line": "invalid JSON"}})
+                continue
+            serializer = self.get_serializer(data=data)
+            if not serializer.is_valid():
+                reports.append({"line": number, "status": 400, "errors": serializer.errors})
+                continue
+            report = {"line": number}
+            reports.append(report)
+            accepted.append((report, serializer.validated_data))
+
+        # products come from the catalog cache, customers of super users are fetched with a single query
+        products = get_product_cache().get_many({validated_data['product_id'] for _, validated_data in accepted})
+        if request.user.is_superuser:
+            customers = User.objects.in_bulk({validated_data['customer_id'] for _, validated_data in accepted})
+        orders = []
+        for report, validated_data in accepted:
+            product = products.get(validated_data['product_id'])
+            if request.user.is_superuser:
+                customer = customers.get(validated_data['customer_id'])
+            else:
+                customer = request.user
+            if product is None:
+                report.update({"status": 400, "errors": {"product": "invalid product id"}})
+            elif customer is None:
+                report.update({"status": 400, "errors": {"user": "super users must provide valid customer"}})
+            else:
+                orders.append((report, BulkOrderSerializer.build_order(validated_data, customer, product,
+                                                                       request.user.is_superuser)))
+
+        with transaction.atomic():
+            Order.objects.bulk_create([order for _, order in orders])
+            outbox.enqueue(order for _, order in orders)
+        for report, order in orders:
+            report.update({"status": 201, "id": order.pk, "total_price": order.total_price})
+
+        return StreamingHttpResponse((json.dumps(report) + '\n' for report in reports),
+                                     content_type='application/x-ndjson')
+
+
+class ProductCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request):
+        return Response(get_product_cache().stats())
+
+
+class HashingStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request):
+        return Response(hashing.get_hashing_service().stats())
+
+
 class UpdateOrderView(generics.UpdateAPIView):
     queryset = Order.objects.all()
     permission_classes = [IsAuthenticated]
@@ -63,11 +239,112 @@ class CreateDNAScopingServiceView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CreateDNAScoringServiceSerializer
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        if serializer.validated_data['asynchronous']:
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers=headers)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class BulkDNAScoringServiceView(generics.GenericAPIView):
+    queryset = DNAService.objects.all()
+    permission_classes = [IsAuthenticated]
+    serializer_class = CreateDNAScoringServiceSerializer
+    parser_classes = [NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        reports = []
+        accepted = []
+        for number, line in request.data:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                reports.append({"line": number, "status": 400, "errors": {"line": "invalid JSON"}})
+                continue
+            if isinstance(data, dict) and isinstance(data.get('service_description'), list):
+                data['service_description'] = json.dumps(data['service_description'])
+            serializer = self.get_serializer(data=data)
+            try:
+                serializer.is_valid(raise_exception=True)
+                gene_count, number_of_proteins = serializer.score_description(serializer.validated_data)
+            except ValidationError as e:
+                reports.append({"line": number, "status": 400, "errors": e.detail})
+                continue
+            report = {"line": number}
+            reports.append(report)
+            accepted.append((report, serializer.validated_data, gene_count, number_of_proteins))
+
+        # every referenced customer is fetched with a single query
+        if request.user.is_superuser:
+            customer_ids = {validated_data.get('customer_id') for _, validated_data, _, _ in accepted}
+            customers = User.objects.in_bulk(customer_ids)
+        services = []
+        for report, validated_data, gene_count, number_of_proteins in accepted:
+            if request.user.is_superuser:
+                customer = customers.get(validated_data.get('customer_id'))
+            else:
+                customer = request.user
+            if customer is None:
+                report.update({"status": 400, "errors": {"user": "super users have to provide valid customer_id"}})
+                continue
+            service = CreateDNAScoringServiceSerializer.build_service(validated_data, customer, gene_count,
+                                                                      number_of_proteins)
+            services.append((report, validated_data['asynchronous'], service))
+
+        with transaction.atomic():
+            DNAService.objects.bulk_create([service for _, _, service in services])
+        for report, asynchronous, service in services:
+            report.update({"status": 202 if asynchronous else 201, "id": service.pk, "number": service.number})
+            if asynchronous:
+                jobs.submit(service)
+            else:
+                report["repeated_genes"] = get_gene_index().record(service)
+
+        return StreamingHttpResponse((json.dumps(report) + '\n' for report in reports),
+                                     content_type='application/x-ndjson')
+
+
+class FastaDNAScoringServiceView(generics.CreateAPIView):
+    queryset = DNAService.objects.all()
+    permission_classes = [IsAuthenticated]
+    serializer_class = FastaDNAScoringServiceSerializer
+    parser_classes = [MultiPartParser]
+
+
+class DNAServiceView(generics.RetrieveAPIView):
+    queryset = DNAService.objects.all()
+    permission_classes = [IsAuthenticated, IsSuperUserOrCustomer]
+    serializer_class = DNAServiceStatusSerializer
+
+
+class VerdictCacheStatsView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request):
+        cache = get_verdict_cache()
+        return Response(cache.stats() if cache is not None else {})
+
 
 class UsersListView(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related('groups')
     permission_classes = [IsAuthenticated, IsSuperUser]
     serializer_class = UserDetailSerializer
+    pagination_class = IdCursorPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [StreamingJSONRenderer]
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, StreamingJSONRenderer):
+            return super().list(request, *args, **kwargs)
+        # every user in one response, read in chunks (with their groups) and written out as they are read
+        queryset = self.filter_queryset(self.get_queryset()).order_by(IdCursorPagination.ordering)
+        serializer = self.get_serializer()
+        users = queryset.iterator(chunk_size=getattr(settings, 'USERS_LIST_CHUNK_SIZE', 1000))
+        return StreamingHttpResponse(request.accepted_renderer.stream(serializer.to_representation(user)
+                                                                      for user in users),
+                                     content_type=request.accepted_renderer.media_type)
 
 
 class UserView(generics.RetrieveAPIView):
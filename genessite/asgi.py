@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genessite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# the apps have to be loaded before the events module is imported
+from dapi.events import order_events  # noqa: E402
+
+# the order events stream is served straight from the event loop, every other request goes to Django
+ORDER_EVENTS_PATH = '/orders/events/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == ORDER_EVENTS_PATH:
+        return await order_events(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -124,11 +125,112 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+AUTHENTICATION_BACKENDS = [
+    'dapi.authentication.PooledModelBackend',
+]
+
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'dapi.authentication.CachedJWTAuthentication',
     ],
 }
+
+# DNA scoring engine used by the services endpoints: 'numpy' (vectorized) or 'python' (per gene)
+DNA_SCORING_ENGINE = 'numpy'
+
+# asynchronous DNA scoring jobs: worker processes (0 runs jobs inline)
+# genes are parsed and scored in batches of DNA_SCORING_CHUNK
+DNA_SCORING_WORKERS = 4
+DNA_SCORING_CHUNK = 1000
+
+# jobs without progress for DNA_JOB_TIMEOUT seconds (their process stopped) are submitted again by the
+# scheduler, which looks for them every DNA_JOB_RECOVERY_INTERVAL seconds, a service whose job was lost
+# DNA_JOB_MAX_ATTEMPTS times is reported as failed
+DNA_JOB_TIMEOUT = 600
+DNA_JOB_RECOVERY_INTERVAL = 60
+DNA_JOB_MAX_ATTEMPTS = 3
+
+# per-gene verdict cache: entries kept in each process (0 disables it) and an optional
+# cache alias from CACHES shared by all worker processes
+DNA_VERDICT_CACHE_SIZE = 100000
+DNA_VERDICT_CACHE_BACKEND = None
+DNA_VERDICT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# zlib compress packed DNA descriptions when it makes them smaller
+DNA_PACKING_COMPRESS = True
+
+# submissions of at least this many characters are scored on all DNA_SCORING_WORKERS at once (0 disables it)
+DNA_SCORING_PARALLEL_THRESHOLD = 2000000
+
+# longest service description accepted in characters (0 disables the limit), above
+# DNA_SCORING_PARALLEL_THRESHOLD so the descriptions the parallel scoring is for still get in
+DNA_MAX_DESCRIPTION_LENGTH = 10000000
+
+# Bloom filter in front of the gene fingerprint table: size in bits and hash functions per fingerprint
+GENE_INDEX_BLOOM_BITS = 1 << 24
+GENE_INDEX_BLOOM_HASHES = 4
+# seconds between the reads of fingerprints stored by other processes, and seconds of rows read again to catch
+# transactions that committed out of pk order
+GENE_INDEX_SYNC_INTERVAL = 1
+GENE_INDEX_SYNC_OVERLAP = 5
+
+# in-process caches (product catalog, authenticated users) read the shared version counters that tell them
+# they are stale at most once per VERSION_CHECK_INTERVAL seconds, changes made in another process are seen
+# that much later
+VERSION_CHECK_INTERVAL = 1
+
+# default window in bases of gc_profile services
+DNA_GC_WINDOW = 50
+
+# default k of kmer_count services
+DNA_KMER_SIZE = 6
+
+# order-ready notification outbox: notifications handled per claim, seconds before a claim left by a
+# processor that died is taken over, and seconds between the processor runs and the sweeps that wake it up
+ORDER_NOTIFICATION_BATCH = 100
+ORDER_NOTIFICATION_CLAIM_TIMEOUT = 300
+ORDER_NOTIFICATION_INTERVAL = 1
+ORDER_NOTIFICATION_SWEEP = 5
+# failed emails are tried again after ORDER_NOTIFICATION_RETRY_BACKOFF seconds, doubled with every failed
+# attempt up to ORDER_NOTIFICATION_RETRY_MAX_DELAY, until an order has ORDER_NOTIFICATION_MAX_ATTEMPTS
+# delivery attempts recorded
+ORDER_NOTIFICATION_RETRY_BACKOFF = 60
+ORDER_NOTIFICATION_RETRY_MAX_DELAY = 3600
+ORDER_NOTIFICATION_MAX_ATTEMPTS = 20
+
+# periodic jobs run in one process per host, the one holding an flock on SCHEDULER_LOCK_FILE, the others
+# retry every SCHEDULER_LEADER_RETRY seconds to take over from a leader that died
+# SCHEDULER_ENABLED None starts the scheduler in server processes only (runserver, gunicorn, uvicorn, ...)
+SCHEDULER_ENABLED = None
+SCHEDULER_LOCK_FILE = Path(tempfile.gettempdir()) / 'genessite-scheduler.lock'
+SCHEDULER_LEADER_RETRY = 10
+
+# order-ready emails: messages per batch (one SMTP connection each) and batches sent at once
+EMAIL_DELIVERY_BATCH = 50
+EMAIL_DELIVERY_WORKERS = 4
+
+# order status events served by genessite.asgi at /orders/events/: seconds between the polls of the
+# per-process poller, seconds of changes read again to catch late commits, seconds between keep-alive
+# comments and events kept for a client that does not read them
+ORDER_EVENTS_POLL_INTERVAL = 1
+ORDER_EVENTS_OVERLAP = 5
+ORDER_EVENTS_HEARTBEAT = 15
+ORDER_EVENTS_QUEUE_SIZE = 100
+
+# users resolved from access tokens, with their groups, are cached per token for AUTH_USER_CACHE_TTL
+# seconds (0 disables it) and dropped early when the user or their groups change
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TTL = 60
+
+# passwords are hashed and checked in PASSWORD_HASHING_WORKERS processes (0 hashes in the calling thread),
+# PASSWORD_HASHING_QUEUE more operations may wait for a worker and the ones beyond that wait up to
+# PASSWORD_HASHING_TIMEOUT seconds for room before the request is answered with 503
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_QUEUE = 32
+PASSWORD_HASHING_TIMEOUT = 5
+
+# users read per query when the users list is streamed in full (?format=stream)
+USERS_LIST_CHUNK_SIZE = 1000